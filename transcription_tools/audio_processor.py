@@ -1,67 +1,529 @@
 import asyncio
+import os
+import shutil
 import tempfile
-from typing import List, Dict
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterable, Awaitable, Callable, Dict, List, Optional, Tuple
 from pathlib import Path
 from rich.progress import Progress, TaskID
 from config import Config
+from discovery import AudioInfo
 from utils import compress_wav, get_output_filename, format_transcript
 from aws_client import AWSTranscribeClient
+from aws_session import parse_s3_uri
+from job_poller import JobNotFoundError
+from journal import JournalBackend, source_identity
+from throttle import AdaptiveLimiter
+from exporters import export_transcript
+from result_cache import ResultCache
+from search_index import SearchIndex
+from telemetry import run_profiled, telemetry
+from transcript_store import from_transcribe_json, save_store, store_path
+from splitter import Chunk, split_wav, merge_chunk_transcripts
+from vad import remap_transcript_times
+
+@dataclass
+class WorkItem:
+    """A file moving through the pipeline, with what each stage produced."""
+    input_file: str
+    output_dir: str
+    audio_seconds: float = 0  # from the preflight header scan, for progress
+    compressed_file: Optional[str] = None
+    duration: int = 0
+    digest: Optional[str] = None
+    source: Optional[str] = None  # journal.source_identity of the input file
+    file_uri: Optional[str] = None
+    job_name: Optional[str] = None
+    submitted_at: Optional[datetime] = None
+    chunks: Optional[List[Chunk]] = None  # set when a long recording is split
+    kept_intervals: Optional[List] = None  # set when silences were trimmed
+    result: Optional[Dict] = None  # cached Transcribe result; skips the upload and the job
+
+async def _release_reader(pipe_path: str, reader: asyncio.Future) -> None:
+    """Unblock a reader waiting on pipe_path after its writer failed to open it."""
+    while not reader.done():
+        try:
+            os.close(os.open(pipe_path, os.O_WRONLY | os.O_NONBLOCK))
+            return
+        except OSError:
+            # No reader has opened the pipe yet
+            await asyncio.sleep(0.05)
 
 class AudioProcessor:
-    def __init__(self, aws_client: AWSTranscribeClient):
+    """Runs files through condition -> upload -> transcribe as a staged pipeline.
+
+    Each stage has its own worker count and hands items to the next stage
+    through a bounded queue, so a slow stage applies backpressure upstream
+    instead of letting work pile up in memory.
+    """
+
+    def __init__(self, aws_client: AWSTranscribeClient, journal: JournalBackend,
+                 index: Optional[SearchIndex] = None, cache: Optional[ResultCache] = None):
         self.aws_client = aws_client
-        self.semaphore = asyncio.Semaphore(Config.MAX_CONCURRENT_JOBS)
+        self.journal = journal
+        self.index = index  # updated with every transcript written
+        self.cache = cache  # results by audio digest, checked before uploading or submitting
+        self.condition_pool = ProcessPoolExecutor(max_workers=Config.CONDITION_WORKERS)
+        self.upload_pool = ThreadPoolExecutor(max_workers=Config.UPLOAD_WORKERS)
+        # Stage worker counts are ceilings; these windows decide how many run
+        self.job_window = AdaptiveLimiter(
+            'jobs', Config.INITIAL_CONCURRENT_JOBS, Config.MAX_CONCURRENT_JOBS
+        )
+        self.upload_window = AdaptiveLimiter(
+            'uploads', Config.INITIAL_UPLOAD_WORKERS, Config.UPLOAD_WORKERS
+        )
+        # Awaited with (input_file, None) when a file is done, or the error that stopped it
+        self.on_finished: Optional[Callable[[str, Optional[Exception]], Awaitable[None]]] = None
 
-    async def process_file(self, input_file: str, output_dir: str, 
-                          progress: Progress, task_id: TaskID) -> None:
-        """Process a single audio file."""
-        try:
-            # Create temporary file for compressed audio
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_file:
-                compressed_file, duration = compress_wav(input_file, temp_file.name)
-                
-                # Upload to S3
-                file_name = Path(input_file).stem
-                s3_key = f"uploads/{file_name}.wav"
-                file_uri = await self.aws_client.upload_to_s3(
-                    compressed_file, "catching-vibes-audio-transcriptions", s3_key
+    @property
+    def streaming(self) -> bool:
+        # The cache is looked up by digest, which a streamed upload only learns at the end
+        if self.cache is not None:
+            return False
+        # A trimmed WAV's length is only known at the end, so its header needs a seek
+        if Config.VAD_ENABLED and Config.UPLOAD_CODEC == 'wav':
+            return False
+        return Config.STREAM_UPLOADS and hasattr(os, 'mkfifo')
+
+    async def condition(self, item: WorkItem) -> WorkItem:
+        """Downmix and resample the input in the process pool.
+
+        A source file seen before under another path (same size, mtime and
+        sampled content) goes straight to formatting when its result is
+        cached, or is passed through when its object is still in S3. A
+        freshly conditioned file whose audio has a cached result skips the
+        upload. When streaming uploads (only without a result cache),
+        conditioning is left to the upload stage so it can run concurrently
+        with the transfer. Recordings longer than Config.SPLIT_THRESHOLD are
+        split into chunks transcribed in parallel.
+        """
+        loop = asyncio.get_running_loop()
+        if Config.SPLIT_LONG_RECORDINGS and item.audio_seconds > Config.SPLIT_THRESHOLD:
+            scratch = tempfile.mkdtemp(dir=Config.SCRATCH_DIR)
+            try:
+                item.duration, item.chunks = await loop.run_in_executor(
+                    self.condition_pool, run_profiled, Config.PROFILE_DIR, 'split', split_wav,
+                    item.input_file, scratch, Config.UPLOAD_CODEC, Config.VAD_ENABLED
                 )
-                
-                # Start transcription
-                job_name = f"transcription_{file_name}"
-                await self.aws_client.start_transcription_job(job_name, file_uri)
-                
-                # Get results
-                transcript = await self.aws_client.get_transcription_result(job_name)
-                
-                # Format and save transcript
-                formatted_text = format_transcript(transcript)
-                output_file = get_output_filename(input_file, output_dir)
-                
-                with open(output_file, 'w') as f:
-                    f.write(formatted_text)
-                
-                progress.update(task_id, advance=1)
-                
-        except Exception as e:
-            progress.console.print(f"Error processing {input_file}: {str(e)}")
+            except BaseException:
+                shutil.rmtree(scratch)
+                raise
+            return item
+
+        item.source = await asyncio.to_thread(source_identity, item.input_file)
+        known = self.journal.find_source_upload(item.source)
+        if known is not None:
+            file_uri, duration, kept_intervals, digest = known
+            item.result = await self._cached(digest)
+            if item.result is not None or await self.aws_client.object_exists(file_uri):
+                item.duration, item.kept_intervals, item.digest = duration, kept_intervals, digest
+                if item.result is None:
+                    item.file_uri = file_uri
+                return item
+        if self.streaming:
+            return item
+
+        fd, temp_path = tempfile.mkstemp(
+            suffix=f'.{Config.UPLOAD_CODEC}', dir=Config.SCRATCH_DIR
+        )
+        os.close(fd)
+        try:
+            (item.compressed_file, item.duration,
+             item.digest, item.kept_intervals) = await loop.run_in_executor(
+                self.condition_pool, run_profiled, Config.PROFILE_DIR, 'condition', compress_wav,
+                item.input_file, temp_path, Config.UPLOAD_CODEC, Config.VAD_ENABLED
+            )
+        except BaseException:
+            os.remove(temp_path)
             raise
+        item.result = await self._cached(item.digest)
+        if item.result is not None:
+            os.remove(item.compressed_file)
+            item.compressed_file = None
+        return item
+
+    async def upload(self, item: WorkItem) -> WorkItem:
+        """Get the conditioned audio into S3 under its content address."""
+        if item.result is not None:
+            # Nothing to send; journal the file so its completion can be recorded
+            self.journal.record_upload(
+                item.input_file, None, item.duration, item.digest, item.kept_intervals
+            )
+            return item
 
-    async def process_batch(self, files: List[str], output_dir: str) -> None:
-        """Process a batch of audio files."""
-        print("starting process_batch")
-        progress = Progress()
-        progress.start()
-    
-        print("made it in")
-        task = progress.add_task(
-            "[cyan]Processing audio files...", 
-            total=len(files)
+        if item.file_uri is not None:
+            self.journal.record_upload(
+                item.input_file, item.file_uri, item.duration,
+                item.digest, item.kept_intervals
+            )
+            return item
+
+        if item.chunks is not None:
+            try:
+                await asyncio.gather(*(self._upload_chunk(chunk) for chunk in item.chunks))
+            finally:
+                shutil.rmtree(os.path.dirname(item.chunks[0].path), ignore_errors=True)
+            # Chunks are indexed individually; the file itself has no single URI
+            self.journal.record_upload(item.input_file, None, item.duration)
+            return item
+
+        async with self.upload_window:
+            if item.compressed_file is None:
+                # Conditioning restarts with the stream, so retry the whole thing
+                await self.upload_window.retry(lambda: self._upload_streamed(item))
+            else:
+                await self._upload_file(item)
+        self.journal.record_upload(
+            item.input_file, item.file_uri, item.duration,
+            item.digest, item.kept_intervals, item.source
         )
-        
-        async def process_with_semaphore(file: str):
-            async with self.semaphore:
-                await self.process_file(file, output_dir, progress, task)
-        
-        tasks = [process_with_semaphore(file) for file in files]
-        await asyncio.gather(*tasks, return_exceptions=True)
+        return item
+
+    def _content_uri(self, digest: str) -> str:
+        known = self.journal.find_upload(digest)
+        if known is not None:
+            return known[0]
+        return f"s3://{Config.S3_BUCKET}/{Config.UPLOAD_PREFIX}{digest}.{Config.UPLOAD_CODEC}"
+
+    async def _upload_file(self, item: WorkItem) -> None:
+        """Upload a conditioned temp file, unless its bytes are already in S3."""
+        file_uri = self._content_uri(item.digest)
+        try:
+            if not await self.upload_window.retry(
+                    lambda: self.aws_client.object_exists(file_uri)):
+                bucket, key = parse_s3_uri(file_uri)
+                await self.upload_window.retry(lambda: self.aws_client.upload_to_s3(
+                    item.compressed_file, bucket, key,
+                    executor=self.upload_pool
+                ))
+            item.file_uri = file_uri
+        finally:
+            os.remove(item.compressed_file)
+            item.compressed_file = None
+
+    async def _upload_chunk(self, chunk: Chunk) -> None:
+        """Upload one chunk of a split recording, unless its result is cached or its bytes are in S3."""
+        chunk.result = await self._cached(chunk.digest)
+        if chunk.result is not None:
+            return
+        file_uri = self._content_uri(chunk.digest)
+        async with self.upload_window:
+            if not await self.upload_window.retry(
+                    lambda: self.aws_client.object_exists(file_uri)):
+                bucket, key = parse_s3_uri(file_uri)
+                await self.upload_window.retry(lambda: self.aws_client.upload_to_s3(
+                    chunk.path, bucket, key,
+                    executor=self.upload_pool
+                ))
+        chunk.file_uri = file_uri
+        self.journal.index_upload(chunk.digest, file_uri, chunk.duration)
+
+    async def _upload_streamed(self, item: WorkItem) -> None:
+        """Condition into a pipe while a multipart upload drains it.
+
+        The digest is only known once the stream ends, so the audio lands
+        under a staging key and is then copied server-side to its content
+        address (or dropped, if that object already exists). Only sources
+        the journal has not seen reach this point, but audio that conditions
+        to bytes already in S3 is still transferred once; set
+        Config.STREAM_UPLOADS = False when that matters more than overlap.
+        """
+        scratch = tempfile.mkdtemp(dir=Config.SCRATCH_DIR)
+        pipe_path = os.path.join(scratch, f'audio.{Config.UPLOAD_CODEC}')
+        os.mkfifo(pipe_path)
+        staging_uri = (f"s3://{Config.S3_BUCKET}/{Config.UPLOAD_PREFIX}staging/"
+                       f"{uuid.uuid4().hex}.{Config.UPLOAD_CODEC}")
+        bucket, key = parse_s3_uri(staging_uri)
+
+        loop = asyncio.get_running_loop()
+        uploading = asyncio.ensure_future(self.aws_client.upload_stream(
+            pipe_path, bucket, key, executor=self.upload_pool
+        ))
+        try:
+            try:
+                _, item.duration, item.digest, item.kept_intervals = await loop.run_in_executor(
+                    self.condition_pool, run_profiled, Config.PROFILE_DIR, 'condition', compress_wav,
+                    item.input_file, pipe_path, Config.UPLOAD_CODEC, Config.VAD_ENABLED
+                )
+            except BaseException:
+                await _release_reader(pipe_path, uploading)
+                await asyncio.gather(uploading, return_exceptions=True)
+                # A failed upload breaks the pipe; report the cause, not the symptom
+                if not uploading.cancelled() and uploading.exception():
+                    raise uploading.exception()
+                raise
+            await uploading
+
+            file_uri = self._content_uri(item.digest)
+            if not await self.upload_window.retry(
+                    lambda: self.aws_client.object_exists(file_uri)):
+                await self.upload_window.retry(
+                    lambda: self.aws_client.copy_object(staging_uri, file_uri)
+                )
+            item.file_uri = file_uri
+        finally:
+            os.remove(pipe_path)
+            os.rmdir(scratch)
+            if uploading.done() and not uploading.cancelled() and not uploading.exception():
+                await self.upload_window.retry(
+                    lambda: self.aws_client.delete_object(staging_uri)
+                )
+
+    async def transcribe(self, item: WorkItem) -> WorkItem:
+        """Submit the job (or reattach to one), wait for it and write the transcript."""
+        if item.chunks is not None:
+            transcript_data = await self._transcribe_chunks(item)
+        else:
+            transcript_data = await self._transcribe_whole(item)
+            # Times refer to the trimmed upload; put them back on the original's timeline
+            transcript_data = remap_transcript_times(transcript_data, item.kept_intervals)
+
+        with telemetry.span('transcribe.write', file=item.input_file):
+            formatted_text = format_transcript(transcript_data)
+            os.makedirs(item.output_dir, exist_ok=True)
+            output_file = get_output_filename(item.input_file, item.output_dir)
+
+            with open(output_file, 'w') as f:
+                f.write(formatted_text)
+            columnar = from_transcribe_json(transcript_data)
+            if Config.EXPORT_FORMATS:
+                export_transcript(columnar, os.path.splitext(output_file)[0],
+                                  Path(item.input_file).stem)
+            indexed_file = output_file
+            if Config.SAVE_TRANSCRIPT_STORE:
+                indexed_file = save_store(store_path(output_file), columnar)
+            if self.index is not None:
+                self.index.add(indexed_file, columnar)
+        self.journal.record_completion(item.input_file, output_file)
+        return item
+
+    async def _submit(self, job_name: str, file_uri: str) -> Tuple[str, datetime]:
+        """Start a job; return the name it was actually submitted as and when.
+
+        Callers hold a job_window slot; a throttled start shrinks the window
+        and is retried after a backoff.
+        """
+        # Poll under the name the job was actually submitted as (it carries a suffix)
+        with telemetry.span('transcribe.submit', job=job_name):
+            return await self.job_window.retry(
+                lambda: self.aws_client.start_transcription_job(job_name, file_uri)
+            )
+
+    async def _wait(self, job_name: str, submitted_at: Optional[datetime],
+                    duration: float) -> Dict:
+        """Wait for a submitted job: Transcribe's queue and run time, plus polling delay."""
+        with telemetry.span('transcribe.job', job=job_name, audio_seconds=duration):
+            return await self.aws_client.get_transcription_result(
+                job_name, submitted_at, duration
+            )
+
+    async def _fetch(self, transcript: Dict) -> Dict:
+        with telemetry.span('transcribe.fetch'):
+            return await self.upload_window.retry(
+                lambda: self.aws_client.fetch_transcript(transcript)
+            )
+
+    async def _cached(self, digest: Optional[str]) -> Optional[Dict]:
+        if self.cache is None or digest is None:
+            return None
+        return await asyncio.to_thread(self.cache.get, digest)
+
+    async def _remember(self, digest: Optional[str], result: Dict) -> None:
+        if self.cache is not None and digest is not None:
+            await asyncio.to_thread(self.cache.put, digest, result)
+
+    async def _transcribe_whole(self, item: WorkItem) -> Dict:
+        if item.result is None:
+            # Files resumed at this stage have not been looked up yet; a
+            # cached result beats reattaching to their job
+            item.result = await self._cached(item.digest)
+        if item.result is not None:
+            return item.result
+        async with self.job_window:
+            transcript = await self._await_whole(item)
+        result = await self._fetch(transcript)
+        await self._remember(item.digest, result)
+        return result
+
+    async def _await_whole(self, item: WorkItem) -> Dict:
+        reattached = item.job_name is not None
+        while True:
+            if item.job_name is None:
+                file_name = Path(item.input_file).stem
+                item.job_name, item.submitted_at = await self._submit(
+                    f"transcription_{file_name}", item.file_uri
+                )
+                self.journal.record_submission(item.input_file, item.job_name, item.submitted_at)
+
+            try:
+                return await self._wait(item.job_name, item.submitted_at, item.duration)
+            except JobNotFoundError:
+                self.journal.record_failure(item.input_file)
+                if not reattached:
+                    raise
+                # A journaled job the service has since expired; run it again
+                reattached = False
+                item.job_name = None
+            except Exception:
+                self.journal.record_failure(item.input_file)
+                raise
+
+    async def _transcribe_chunks(self, item: WorkItem) -> Dict:
+        """Run every chunk of a split recording as its own job and merge the results."""
+        file_name = Path(item.input_file).stem
+        # Jobs an earlier run submitted for the same chunk audio are reattached
+        submitted = self.journal.find_chunk_jobs(item.input_file)
+        for index, chunk in enumerate(item.chunks):
+            if index in submitted and submitted[index][0] == chunk.digest:
+                _, chunk.job_name, chunk.submitted_at = submitted[index]
+
+        async def run(index: int, chunk: Chunk) -> Dict:
+            if chunk.result is not None:
+                return chunk.result
+            reattached = chunk.job_name is not None
+            async with self.job_window:
+                while True:
+                    if chunk.job_name is None:
+                        chunk.job_name, chunk.submitted_at = await self._submit(
+                            f"transcription_{file_name}_part{index:03d}", chunk.file_uri
+                        )
+                        self.journal.record_chunk_submission(
+                            item.input_file, index, chunk.digest,
+                            chunk.job_name, chunk.submitted_at
+                        )
+                    try:
+                        transcript = await self._wait(
+                            chunk.job_name, chunk.submitted_at, chunk.duration
+                        )
+                        break
+                    except JobNotFoundError:
+                        self.journal.record_chunk_failure(item.input_file, index)
+                        if not reattached:
+                            raise
+                        reattached = False
+                        chunk.job_name = None
+                    except Exception:
+                        self.journal.record_chunk_failure(item.input_file, index)
+                        raise
+            result = await self._fetch(transcript)
+            await self._remember(chunk.digest, result)
+            return result
+
+        results = await asyncio.gather(*(run(i, chunk) for i, chunk in enumerate(item.chunks)))
+        return merge_chunk_transcripts(item.chunks, results)
+
+    async def _run_stage(self, handler: Callable[[WorkItem], Awaitable[WorkItem]],
+                         inbox: asyncio.Queue, outbox: Optional[asyncio.Queue],
+                         workers: int, downstream_workers: int,
+                         progress: Progress, task_id: TaskID) -> None:
+        """Drain inbox with `workers` concurrent handlers, feeding outbox.
+
+        Each handled item is a `stage.<name>` span; time spent blocked on a
+        full outbox is a `blocked.<name>` span, i.e. the next stage is behind.
+        """
+        stage = handler.__name__
+
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is None:
+                    return
+                try:
+                    with telemetry.span(f"stage.{stage}", file=item.input_file):
+                        item = await handler(item)
+                except Exception as e:
+                    telemetry.count('files_failed', stage=stage)
+                    progress.console.print(f"Error processing {item.input_file}: {str(e)}")
+                    await self._finished(item.input_file, e)
+                    continue
+                if outbox is None:
+                    telemetry.count('files_completed')
+                    progress.update(task_id, advance=item.audio_seconds)
+                    await self._finished(item.input_file)
+                else:
+                    with telemetry.span(f"blocked.{stage}"):
+                        await outbox.put(item)
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        # Every worker of this stage is done; tell the next stage's workers to stop
+        if outbox is not None:
+            for _ in range(downstream_workers):
+                await outbox.put(None)
+
+    async def _finished(self, input_file: str, error: Optional[Exception] = None) -> None:
+        if self.on_finished is not None:
+            await self.on_finished(input_file, error)
+
+    async def process_files(self, files: AsyncIterable[AudioInfo], input_dir: str,
+                            output_dir: str, progress: Progress, task_id: TaskID) -> None:
+        """Stream files through the pipeline, admitting each as soon as there is room.
+
+        files is consumed lazily, so discovery can still be running while
+        the first files are uploaded.
+
+        There are no batch barriers: a long recording only occupies its own
+        slot while the remaining files keep flowing past it. Files the journal
+        shows as finished are skipped, and files already uploaded or submitted
+        by an earlier run re-enter at the transcribe stage. Progress advances
+        by each file's audio seconds. Outputs go under output_dir in the same
+        subdirectory the input had under input_dir, so names never collide.
+        """
+        def show_limits():
+            progress.update(task_id, limits=(
+                f"jobs {self.job_window.window}/{self.job_window.maximum} "
+                f"uploads {self.upload_window.window}/{self.upload_window.maximum}"
+            ))
+        self.job_window.on_change = show_limits
+        self.upload_window.on_change = show_limits
+        show_limits()
+
+        to_condition = asyncio.Queue(maxsize=Config.STAGE_QUEUE_SIZE)
+        to_upload = asyncio.Queue(maxsize=Config.STAGE_QUEUE_SIZE)
+        to_transcribe = asyncio.Queue(maxsize=Config.STAGE_QUEUE_SIZE)
+
+        async def feed():
+            async for info in files:
+                item_dir = os.path.join(
+                    output_dir, os.path.relpath(os.path.dirname(info.path), input_dir)
+                )
+                entry = self.journal.get(info.path)
+                if entry is not None and entry.completed:
+                    progress.update(task_id, advance=info.duration)
+                    await self._finished(info.path)
+                elif entry is None or entry.file_uri is None:
+                    # Split and cache-served files have no single upload to resume from
+                    await to_condition.put(WorkItem(info.path, item_dir, info.duration))
+                else:
+                    # Already uploaded (and maybe submitted): resume at the transcribe stage
+                    await to_transcribe.put(WorkItem(
+                        info.path, item_dir, info.duration,
+                        duration=entry.duration,
+                        file_uri=entry.file_uri,
+                        job_name=entry.job_name,
+                        submitted_at=entry.submitted_at,
+                        kept_intervals=entry.kept_intervals,
+                        digest=entry.digest,
+                    ))
+            for _ in range(Config.CONDITION_WORKERS):
+                await to_condition.put(None)
+
+        await asyncio.gather(
+            feed(),
+            self._run_stage(self.condition, to_condition, to_upload,
+                            Config.CONDITION_WORKERS, Config.UPLOAD_WORKERS,
+                            progress, task_id),
+            self._run_stage(self.upload, to_upload, to_transcribe,
+                            Config.UPLOAD_WORKERS, Config.MAX_CONCURRENT_JOBS,
+                            progress, task_id),
+            self._run_stage(self.transcribe, to_transcribe, None,
+                            Config.MAX_CONCURRENT_JOBS, 0,
+                            progress, task_id),
+        )
+
+    def close(self) -> None:
+        """Shut down the stage worker pools."""
+        self.condition_pool.shutdown()
+        self.upload_pool.shutdown()
@@ -1,69 +1,239 @@
-import boto3
 import asyncio
-from typing import Dict
+import functools
+from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import Executor
+import json
+import os
+from typing import Dict, Optional, Tuple
+from urllib.request import urlopen
 from botocore.exceptions import ClientError
+from datetime import datetime, timedelta, timezone
+from aws_session import get_client, parse_s3_uri
+from backends import JobStatus, TranscriptionBackend, job_settings, open_backend
 from config import Config
+from job_poller import JobPoller
+from telemetry import telemetry
+from throttle import ThrottledError, is_throttling
 import random
 
-class AWSTranscribeClient:
+def _failure(message: str, e: Exception) -> Exception:
+    """Wrap an AWS error, keeping throttling distinguishable so callers can retry it."""
+    if is_throttling(e):
+        return ThrottledError(f"{message}: {str(e)}")
+    return Exception(f"{message}: {str(e)}")
+
+def _count_uploaded(sent: int) -> None:
+    # s3transfer progress callback, called from its threads as parts go out
+    telemetry.count('bytes_uploaded', sent)
+
+def _read_url(uri: str) -> bytes:
+    with urlopen(uri) as response:
+        return response.read()
+
+class AWSTranscribeBackend(TranscriptionBackend):
+    """Amazon Transcribe batch jobs, with results written to Config.S3_BUCKET."""
+
     def __init__(self):
-        self.client = boto3.client('transcribe', region_name=Config.AWS_REGION)
-        self.s3_client = boto3.client('s3', region_name=Config.AWS_REGION)
+        self.client = get_client('transcribe')
+        self.s3_client = get_client('s3')
 
-    async def start_transcription_job(self, job_name: str, file_uri: str) -> Dict:
-        """Start an AWS Transcribe job."""
+    def submit(self, job_name: str, media_uri: str) -> Tuple[str, datetime]:
+        """Start a job; the media format follows the URI's extension."""
+        submitted_name = f"{job_name}_{str(random.random()).replace('.', '')}"
+        response = self.client.start_transcription_job(
+            TranscriptionJobName=submitted_name,
+            Media={'MediaFileUri': media_uri},
+            MediaFormat=os.path.splitext(media_uri)[1].lstrip('.').lower() or 'wav',
+            # Keep results in our bucket so fetch_result can use the S3 client
+            OutputBucketName=Config.S3_BUCKET,
+            OutputKey=f"{Config.TRANSCRIPT_PREFIX}{submitted_name}.json",
+            **job_settings()
+        )
+        job = response['TranscriptionJob']
+        return job['TranscriptionJobName'], job.get('CreationTime') or datetime.now(timezone.utc)
+
+    def status_batch(self, jobs: Dict[str, datetime]) -> Dict[str, JobStatus]:
+        """List COMPLETED and FAILED jobs in bulk and pick out the tracked ones."""
+        finished = {}
+        # Jobs are listed newest first, so stop paging once past the oldest tracked job
+        oldest = min(jobs.values()) - timedelta(minutes=5)
+        for status in ('COMPLETED', 'FAILED'):
+            kwargs = {
+                'Status': status,
+                'JobNameContains': Config.JOB_NAME_PREFIX,
+                'MaxResults': 100,
+            }
+            while True:
+                response = self.client.list_transcription_jobs(**kwargs)
+                summaries = response.get('TranscriptionJobSummaries', [])
+                for summary in summaries:
+                    name = summary['TranscriptionJobName']
+                    if name in jobs:
+                        finished[name] = JobStatus(
+                            name, status, failure_reason=summary.get('FailureReason')
+                        )
+                if len(finished) == len(jobs) or 'NextToken' not in response:
+                    break
+                if summaries and summaries[-1]['CreationTime'] < oldest:
+                    break
+                kwargs['NextToken'] = response['NextToken']
+
+        # Summaries carry no transcript location, so fetch it once per completed job
+        for job in finished.values():
+            if job.status == 'COMPLETED':
+                response = self.client.get_transcription_job(TranscriptionJobName=job.name)
+                job.transcript = response['TranscriptionJob']['Transcript']
+        return finished
+
+    def lookup(self, job_name: str) -> Optional[JobStatus]:
         try:
-            response = await asyncio.to_thread(
-                self.client.start_transcription_job,
-                TranscriptionJobName=f"{job_name}_{str(random.random()).replace('.', '')}",
-                Media={'MediaFileUri': file_uri},
-                MediaFormat='wav',
-                LanguageCode='es-US',
-                Settings={
-                    'ShowSpeakerLabels': True,
-                    'MaxSpeakerLabels': 10
-                }
-            )
-            return response
+            job = self.client.get_transcription_job(TranscriptionJobName=job_name)['TranscriptionJob']
         except ClientError as e:
-            raise Exception(f"Failed to start transcription job: {str(e)}")
+            error = e.response.get('Error', {})
+            # Transcribe answers BadRequestException for job names it does not know
+            if (error.get('Code') == 'NotFoundException'
+                    or 'be found' in error.get('Message', '')):
+                return None
+            raise
+        status = job['TranscriptionJobStatus']
+        return JobStatus(
+            job_name, status,
+            transcript=job.get('Transcript') if status == 'COMPLETED' else None,
+            failure_reason=job.get('FailureReason'),
+        )
+
+    def fetch_result(self, transcript: Dict) -> bytes:
+        uri = transcript['TranscriptFileUri']
+        location = parse_s3_uri(uri)
+        if location is None:
+            # Service-managed output is a presigned HTTPS URL
+            return _read_url(uri)
+        bucket, key = location
+        return self.s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
 
-    async def get_transcription_result(self, job_name: str) -> Dict:
-        """Get the results of a transcription job."""
-        attempt = None
+class AWSTranscribeClient:
+    """What the pipeline needs from AWS: S3 transfers, plus a transcription backend.
+
+    Jobs go to `backend` (Config.TRANSCRIBE_BACKEND by default), so the
+    pipeline can run against the local fake in fake_backend.py.
+    """
+
+    def __init__(self, backend: Optional[TranscriptionBackend] = None):
+        self.backend = backend or open_backend()
+        self.s3_client = get_client('s3')
+        self.transfer_config = TransferConfig(
+            multipart_threshold=Config.MULTIPART_CHUNK_SIZE,
+            multipart_chunksize=Config.MULTIPART_CHUNK_SIZE,
+            max_concurrency=Config.MULTIPART_CONCURRENCY,
+        )
+        self.poller = JobPoller(self.backend)
+
+    async def start_transcription_job(self, job_name: str, file_uri: str) -> Tuple[str, datetime]:
+        """Start a job; return the name it was actually submitted under and when."""
         try:
-            for _ in range(Config.MAX_RETRIES):
-                attempt = _
-                response = await asyncio.to_thread(
-                    self.client.get_transcription_job,
-                    TranscriptionJobName=job_name
-                )
-                
-                status = response['TranscriptionJob']['TranscriptionJobStatus']
-                
-                if status == 'COMPLETED':
-                    print(f'Num of retries until completion: {attempt}')
-                    print(response)
-                    return response['TranscriptionJob']['Transcript']
-                elif status == 'FAILED':
-                    raise Exception(f"Transcription job failed: {response['TranscriptionJob']['FailureReason']}")
-                
-                await asyncio.sleep(Config.RETRY_DELAY)
-
-            raise Exception("Transcription job timed out")
+            with telemetry.api_call('submit'):
+                return await asyncio.to_thread(self.backend.submit, job_name, file_uri)
+        except ClientError as e:
+            raise _failure("Failed to start transcription job", e)
+
+    async def get_transcription_result(self, job_name: str,
+                                       created: Optional[datetime] = None,
+                                       duration: float = 0) -> Dict:
+        """Wait for a submitted job to finish and return its Transcript.
+
+        `job_name` must be the name the job was actually submitted under.
+        Status is refreshed in bulk by the shared JobPoller; `duration` (audio
+        seconds) tells it roughly when the job is worth asking about.
+        """
+        return await self.poller.track(job_name, created, duration)
+
+    async def fetch_transcript(self, transcript: Dict) -> Dict:
+        """Download a job's result JSON straight into memory and parse it."""
+        try:
+            with telemetry.api_call('fetch_result'):
+                body = await asyncio.to_thread(self.backend.fetch_result, transcript)
+            telemetry.count('bytes_downloaded', len(body))
+            return json.loads(body)
         except ClientError as e:
-            print(f'Num of retries until failure: {attempt}')
-            raise Exception(f"Failed to get transcription result: {str(e)}")
+            raise _failure("Failed to fetch transcript", e)
+
+    async def object_exists(self, file_uri: str) -> bool:
+        """HEAD an s3:// URI; True if the object is there."""
+        bucket, key = parse_s3_uri(file_uri)
+        try:
+            with telemetry.api_call('head_object'):
+                await asyncio.to_thread(self.s3_client.head_object, Bucket=bucket, Key=key)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise _failure("Failed to check S3 object", e)
+
+    async def upload_to_s3(self, file_path: str, bucket: str, key: str,
+                           executor: Optional[Executor] = None) -> str:
+        """Upload file to S3 and return the URI.
+
+        Runs on `executor` when given, otherwise on the loop's default executor.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+            with telemetry.api_call('upload_file'):
+                await loop.run_in_executor(
+                    executor,
+                    functools.partial(
+                        self.s3_client.upload_file,
+                        file_path, bucket, key,
+                        Config=self.transfer_config,
+                        Callback=_count_uploaded
+                    )
+                )
+            return f"s3://{bucket}/{key}"
+        except (ClientError, S3UploadFailedError) as e:
+            raise _failure("Failed to upload file to S3", e)
+
+    async def upload_stream(self, stream_path: str, bucket: str, key: str,
+                            executor: Optional[Executor] = None) -> str:
+        """Upload whatever is written to the pipe at stream_path, as it arrives.
+
+        Parts of Config.MULTIPART_CHUNK_SIZE are sent as soon as they fill,
+        so the upload overlaps with whatever process is producing the data.
+        """
+        def upload():
+            with open(stream_path, 'rb') as stream:
+                self.s3_client.upload_fileobj(
+                    stream, bucket, key, Config=self.transfer_config,
+                    Callback=_count_uploaded
+                )
 
-    async def upload_to_s3(self, file_path: str, bucket: str, key: str) -> str:
-        """Upload file to S3 and return the URI."""
         try:
-            await asyncio.to_thread(
-                self.s3_client.upload_file,
-                file_path,
-                bucket,
-                key
-            )
+            loop = asyncio.get_running_loop()
+            with telemetry.api_call('upload_fileobj'):
+                await loop.run_in_executor(executor, upload)
             return f"s3://{bucket}/{key}"
+        except (ClientError, S3UploadFailedError) as e:
+            raise _failure("Failed to upload stream to S3", e)
+
+    async def copy_object(self, source_uri: str, dest_uri: str) -> None:
+        """Server-side copy between two s3:// URIs."""
+        source_bucket, source_key = parse_s3_uri(source_uri)
+        dest_bucket, dest_key = parse_s3_uri(dest_uri)
+        try:
+            with telemetry.api_call('copy'):
+                await asyncio.to_thread(
+                    self.s3_client.copy,
+                    {'Bucket': source_bucket, 'Key': source_key},
+                    dest_bucket, dest_key,
+                    Config=self.transfer_config
+                )
+        except ClientError as e:
+            raise _failure("Failed to copy S3 object", e)
+
+    async def delete_object(self, file_uri: str) -> None:
+        """Delete an s3:// URI."""
+        bucket, key = parse_s3_uri(file_uri)
+        try:
+            with telemetry.api_call('delete_object'):
+                await asyncio.to_thread(self.s3_client.delete_object, Bucket=bucket, Key=key)
         except ClientError as e:
-            raise Exception(f"Failed to upload file to S3: {str(e)}")
+            raise _failure("Failed to delete S3 object", e)
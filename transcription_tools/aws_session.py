@@ -0,0 +1,61 @@
+import threading
+from typing import Dict, Optional, Tuple
+from urllib.parse import unquote, urlparse
+from config import Config
+
+_lock = threading.RLock()
+_session = None
+_clients: Dict[str, object] = {}
+
+def parse_s3_uri(uri: str) -> Optional[Tuple[str, str]]:
+    """Return (bucket, key) for s3:// and unsigned S3 HTTPS URIs, else None."""
+    parsed = urlparse(uri)
+    if parsed.scheme == 's3':
+        return parsed.netloc, parsed.path.lstrip('/')
+    if parsed.query or not parsed.netloc.endswith('.amazonaws.com'):
+        return None
+    host = parsed.netloc
+    path = unquote(parsed.path.lstrip('/'))
+    if host.startswith('s3.') or host.startswith('s3-'):
+        # Path-style: https://s3.<region>.amazonaws.com/<bucket>/<key>
+        bucket, _, key = path.partition('/')
+        return bucket, key
+    # Virtual-hosted: https://<bucket>.s3.<region>.amazonaws.com/<key>
+    return host.split('.s3', 1)[0], path
+
+def default_pool_size(service: str) -> int:
+    """Connections a service's client needs at the configured concurrency."""
+    if service == 's3':
+        # Each upload in the window runs its own multipart threads, plus HEADs and fetches
+        return Config.UPLOAD_WORKERS * (Config.MULTIPART_CONCURRENCY + 1)
+    return Config.MAX_CONCURRENT_JOBS
+
+def get_session():
+    """The process's boto3 session, created (and boto3 imported) on first use."""
+    global _session
+    with _lock:
+        if _session is None:
+            import boto3
+            _session = boto3.session.Session(region_name=Config.AWS_REGION)
+        return _session
+
+def get_client(service: str, pool_size: Optional[int] = None):
+    """The process's shared client for `service`, created on first use.
+
+    botocore clients are thread-safe, so every module and worker thread
+    shares one client per service and its pool of kept-alive connections
+    instead of paying for new TLS handshakes. The pool holds
+    max(pool_size, default_pool_size(service)) connections; the size is
+    fixed when the client is created.
+    """
+    with _lock:
+        client = _clients.get(service)
+        if client is None:
+            from botocore.config import Config as BotoConfig
+            size = max(pool_size or 0, default_pool_size(service))
+            client = get_session().client(service, config=BotoConfig(
+                max_pool_connections=size,
+                tcp_keepalive=True,
+            ))
+            _clients[service] = client
+        return client
@@ -0,0 +1,61 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from config import Config
+
+@dataclass
+class JobStatus:
+    """A job's state as reported by a backend."""
+    name: str
+    status: str  # COMPLETED or FAILED; lookup may also report QUEUED or IN_PROGRESS
+    transcript: Optional[Dict] = None  # {'TranscriptFileUri': ...} when COMPLETED
+    failure_reason: Optional[str] = None
+
+class TranscriptionBackend(ABC):
+    """Where transcription jobs run: submit, check on many at once, fetch results.
+
+    Methods block and are called from worker threads. Errors are raised as
+    botocore ClientError (real or synthesised), so throttling is classified
+    the same way whichever backend is in use.
+    """
+
+    @abstractmethod
+    def submit(self, job_name: str, media_uri: str) -> Tuple[str, datetime]:
+        """Start a job; return the name it was submitted under and its creation time."""
+
+    @abstractmethod
+    def status_batch(self, jobs: Dict[str, datetime]) -> Dict[str, JobStatus]:
+        """Return the jobs among `jobs` (name -> creation time) that have finished."""
+
+    @abstractmethod
+    def lookup(self, job_name: str) -> Optional[JobStatus]:
+        """Return one job's current state, or None if the backend does not know it."""
+
+    @abstractmethod
+    def fetch_result(self, transcript: Dict) -> bytes:
+        """Return the raw result JSON of a COMPLETED job."""
+
+def job_settings() -> Dict:
+    """Transcription settings every job is submitted with (StartTranscriptionJob shape).
+
+    They are part of the result cache key, so changing them never serves
+    results made with the old ones.
+    """
+    return {
+        'LanguageCode': Config.TRANSCRIBE_LANGUAGE,
+        'Settings': {
+            'ShowSpeakerLabels': True,
+            'MaxSpeakerLabels': Config.MAX_SPEAKER_LABELS,
+        },
+    }
+
+def open_backend() -> TranscriptionBackend:
+    """Create the backend selected by Config.TRANSCRIBE_BACKEND."""
+    if Config.TRANSCRIBE_BACKEND == 'aws':
+        from aws_client import AWSTranscribeBackend
+        return AWSTranscribeBackend()
+    if Config.TRANSCRIBE_BACKEND == 'fake':
+        from fake_backend import FakeTranscribeBackend
+        return FakeTranscribeBackend()
+    raise ValueError(f"Unknown transcription backend: {Config.TRANSCRIBE_BACKEND}")
@@ -0,0 +1,488 @@
+import argparse
+import ast
+import asyncio
+import contextlib
+import functools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from rich.console import Console
+from rich.markup import escape
+from rich.table import Table
+from config import Config
+
+console = Console(stderr=True)
+
+@dataclass
+class WavSpec:
+    """`count` synthetic recordings of one shape."""
+    count: int
+    seconds: float
+    rate: int
+    channels: int
+    width: int  # bytes per sample
+
+# Mixed rates, channel counts and sample widths, as field recorders produce them
+CORPORA = {
+    'quick': [
+        WavSpec(8, 30, 44100, 2, 2),
+        WavSpec(4, 60, 48000, 1, 3),
+        WavSpec(4, 20, 16000, 1, 2),
+        WavSpec(2, 10, 96000, 2, 4),
+    ],
+    'full': [
+        WavSpec(40, 60, 44100, 2, 2),
+        WavSpec(20, 300, 48000, 2, 3),
+        WavSpec(20, 120, 16000, 1, 2),
+        WavSpec(8, 30, 96000, 2, 4),
+        WavSpec(4, 15, 8000, 1, 1),
+        # Above Config.SPLIT_THRESHOLD, so the splitter runs (SPLIT_LONG_RECORDINGS is on here)
+        WavSpec(1, 32 * 60, 16000, 1, 2),
+    ],
+}
+
+# Word counts of the sample transcript JSON: short clip to hour-long interview
+TRANSCRIPT_WORDS = {'quick': [200] * 20 + [2000] * 8 + [20000] * 2,
+                    'full': [200] * 200 + [2000] * 80 + [20000] * 20}
+
+# compress_wav variants: (codec, trim_silence); flac/ogg run only if ffmpeg is installed
+COMPRESS_VARIANTS = [('wav', False), ('wav', True), ('flac', False), ('ogg', False)]
+
+# Applied before --set overrides: a local stand-in for S3/Transcribe that
+# polls often enough for short fake jobs
+PIPELINE_DEFAULTS = {
+    'TRANSCRIBE_BACKEND': 'fake',
+    'S3_BACKEND': 'moto',
+    'FAKE_JOB_LATENCY': 1.0,
+    'POLL_MIN_INTERVAL': 0.2,
+    'POLL_MAX_INTERVAL': 1.0,
+    # Off by default; on here so the long 'full' recording goes through the splitter
+    'SPLIT_LONG_RECORDINGS': True,
+}
+
+BENCHMARKS = ('pipeline', 'compress', 'format', 'extract')
+
+def _encode_pcm(samples: np.ndarray, width: int) -> bytes:
+    """Encode (frames, channels) float samples in [-1, 1) as little-endian PCM."""
+    if width == 1:
+        return (np.clip(samples * 128 + 128, 0, 255)).astype(np.uint8).tobytes()
+    scale = float(1 << (8 * width - 1))
+    ints = np.clip(np.rint(samples * scale), -scale, scale - 1).astype('<i4')
+    if width == 4:
+        return ints.tobytes()
+    if width == 2:
+        return ints.astype('<i2').tobytes()
+    # 24-bit: keep the low three bytes of each int32
+    return ints.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+def write_synthetic_wav(path: str, spec: WavSpec, seed: int) -> None:
+    """Write speech-like audio: modulated tones and noise, with long pauses.
+
+    Every 20 s has 5 s of near-silence, so voice-activity trimming has
+    something to drop. Written a block at a time, so long files take no
+    more memory than short ones.
+    """
+    rng = np.random.default_rng(seed)
+    frames = int(spec.seconds * spec.rate)
+    pitch = rng.uniform(100, 250)
+    with wave.open(path, 'wb') as wav_out:
+        wav_out.setnchannels(spec.channels)
+        wav_out.setsampwidth(spec.width)
+        wav_out.setframerate(spec.rate)
+        for start in range(0, frames, Config.CHUNK_FRAMES):
+            t = np.arange(start, min(start + Config.CHUNK_FRAMES, frames)) / spec.rate
+            envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)  # syllable rate
+            voiced = (t % 20) < 15
+            signal = envelope * (0.4 * np.sin(2 * np.pi * pitch * t)
+                                 + 0.2 * np.sin(2 * np.pi * 2.7 * pitch * t))
+            signal = np.where(voiced, signal, 0.0) + rng.normal(0, 0.002, len(t))
+            block = np.repeat(signal[:, None], spec.channels, axis=1)
+            wav_out.writeframesraw(_encode_pcm(block, spec.width))
+
+def make_corpus(folder: str, specs: List[WavSpec]) -> None:
+    """Generate the WAV corpus under folder, one subdirectory per spec."""
+    seed = 0
+    for index, spec in enumerate(specs):
+        subdir = os.path.join(folder, f"set{index}_{spec.rate}hz_{spec.channels}ch_{spec.width * 8}bit")
+        os.makedirs(subdir, exist_ok=True)
+        for i in range(spec.count):
+            write_synthetic_wav(os.path.join(subdir, f"bench-{i:04d}.wav"), spec, seed)
+            seed += 1
+
+def make_transcripts(folder: str, word_counts: List[int]) -> None:
+    """Write Transcribe-shaped result JSON, named like downloaded results."""
+    from fake_backend import fake_result
+
+    os.makedirs(folder, exist_ok=True)
+    for i, words in enumerate(word_counts):
+        name = f"transcription_bench-{i:04d}_{i * 7919 % 100000:05d}"
+        with open(os.path.join(folder, f"{name}.json"), 'w', encoding='utf-8') as f:
+            json.dump(fake_result(name, words), f)
+
+def prepare_workdir(workdir: str, corpus: str) -> None:
+    """Generate the corpus and transcripts, unless workdir already has this corpus."""
+    marker = os.path.join(workdir, 'corpus.json')
+    if os.path.exists(marker):
+        with open(marker, 'r', encoding='utf-8') as f:
+            if json.load(f) == corpus:
+                return
+    for name in ('wav', 'json'):
+        shutil.rmtree(os.path.join(workdir, name), ignore_errors=True)
+    console.print(f"Generating the '{corpus}' corpus in {escape(workdir)}...")
+    make_corpus(os.path.join(workdir, 'wav'), CORPORA[corpus])
+    make_transcripts(os.path.join(workdir, 'json'), TRANSCRIPT_WORDS[corpus])
+    with open(marker, 'w', encoding='utf-8') as f:
+        json.dump(corpus, f)
+
+def percentiles(seconds: List[float]) -> Dict[str, float]:
+    """Nearest-rank p50/p90/p99/max of a list of durations, in milliseconds."""
+    if not seconds:
+        return {'count': 0}
+    ordered = sorted(seconds)
+
+    def rank(p):
+        return round(ordered[max(0, -(-len(ordered) * p // 100) - 1)] * 1000, 3)
+    return {'count': len(ordered), 'p50_ms': rank(50), 'p90_ms': rank(90),
+            'p99_ms': rank(99), 'max_ms': round(ordered[-1] * 1000, 3)}
+
+def _rates(files: int, audio_seconds: float, wall: float) -> Dict[str, float]:
+    return {
+        'files': files,
+        'audio_seconds': round(audio_seconds, 3),
+        'wall_seconds': round(wall, 3),
+        'files_per_second': round(files / wall, 3) if wall else None,
+        'audio_seconds_per_second': round(audio_seconds / wall, 3) if wall else None,
+    }
+
+def _wav_files(folder: str) -> List[str]:
+    from discovery import iter_wav_files
+    return sorted(iter_wav_files(folder))
+
+def _audio_seconds(paths: List[str]) -> float:
+    from discovery import probe_wav
+    return sum(probe_wav(path).duration for path in paths)
+
+def bench_pipeline(workdir: str) -> Dict:
+    """Run Transcriber.process_directory over the corpus against the local stand-ins.
+
+    Each stage handler is timed per item, so a slow stage shows up in its
+    latency percentiles rather than only in the total. With streaming
+    uploads the audio is conditioned inside the upload stage, so 'upload'
+    includes conditioning and 'condition' only the cache and journal
+    checks; the report says which applied.
+    """
+    from telemetry import telemetry
+    from transcriber import Transcriber
+
+    input_dir = os.path.join(workdir, 'wav')
+    output_dir = os.path.join(workdir, 'pipeline_out')
+    shutil.rmtree(output_dir, ignore_errors=True)
+    for path in (Config.JOURNAL_PATH, Config.SEARCH_INDEX_PATH, Config.FAKE_JOBS_PATH):
+        for suffix in ('', '-wal', '-shm'):
+            if path and os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    paths = _wav_files(input_dir)
+
+    transcriber = Transcriber()
+    transcriber.console = Console(quiet=True)
+    processor = transcriber.processor
+    # This process was spawned, so its condition workers are too and would
+    # import Config afresh; hand them the overridden settings
+    settings = {name: value for name, value in vars(Config).items() if name.isupper()}
+    processor.condition_pool.shutdown()
+    processor.condition_pool = ProcessPoolExecutor(
+        max_workers=Config.CONDITION_WORKERS, initializer=apply_overrides, initargs=(settings,)
+    )
+    stages = {'condition': [], 'upload': [], 'transcribe': []}
+    for stage, samples in stages.items():
+        setattr(processor, stage, _timed(getattr(processor, stage), samples))
+
+    start = time.perf_counter()
+    asyncio.run(transcriber.process_directory(input_dir, output_dir))
+    wall = time.perf_counter() - start
+
+    completed = sum(name.endswith('.txt') for _, _, names in os.walk(output_dir) for name in names)
+    result = _rates(len(paths), _audio_seconds(paths), wall)
+    result['completed'] = completed
+    result['stages'] = {stage: percentiles(samples) for stage, samples in stages.items()}
+    result['conditioned_in_upload'] = processor.streaming
+    result['counters'] = {
+        name + ''.join(f"[{label}]" for _, label in labels): value
+        for (name, labels), value in sorted(telemetry.counters.items())
+    }
+    backend = transcriber.aws_client.backend
+    if hasattr(backend, 'throttled'):
+        result['backend_calls'] = backend.calls
+        result['backend_throttled'] = backend.throttled
+    return result
+
+def _timed(handler: Callable, samples: List[float]) -> Callable:
+    # Keeps the handler's name, which the pipeline uses to label its spans
+    @functools.wraps(handler)
+    async def timed(item):
+        start = time.perf_counter()
+        try:
+            return await handler(item)
+        finally:
+            samples.append(time.perf_counter() - start)
+    return timed
+
+def bench_compress(workdir: str, codec: str, trim_silence: bool) -> Dict:
+    """Condition every corpus file with compress_wav, one at a time."""
+    from utils import compress_wav
+
+    paths = _wav_files(os.path.join(workdir, 'wav'))
+    scratch = tempfile.mkdtemp(dir=workdir)
+    latencies = []
+    out_bytes = 0
+    try:
+        start = time.perf_counter()
+        for i, path in enumerate(paths):
+            output_file = os.path.join(scratch, f"{i}.{codec}")
+            began = time.perf_counter()
+            compress_wav(path, output_file, codec, trim_silence)
+            latencies.append(time.perf_counter() - began)
+            out_bytes += os.path.getsize(output_file)
+            os.remove(output_file)
+        wall = time.perf_counter() - start
+    finally:
+        shutil.rmtree(scratch)
+    result = _rates(len(paths), _audio_seconds(paths), wall)
+    result['output_bytes'] = out_bytes
+    result['latency'] = percentiles(latencies)
+    return result
+
+def bench_format(workdir: str) -> Dict:
+    """Parse each sample result and run format_transcript on it."""
+    from utils import format_transcript
+
+    folder = os.path.join(workdir, 'json')
+    parse, fmt = [], []
+    words = 0
+    start = time.perf_counter()
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith('.json'):
+            continue
+        with open(os.path.join(folder, name), 'rb') as f:
+            raw = f.read()
+        began = time.perf_counter()
+        data = json.loads(raw)
+        parsed = time.perf_counter()
+        format_transcript(data)
+        parse.append(parsed - began)
+        fmt.append(time.perf_counter() - parsed)
+        words += len(data['results']['items'])
+    wall = time.perf_counter() - start
+    return {
+        'files': len(fmt),
+        'items': words,
+        'wall_seconds': round(wall, 3),
+        'files_per_second': round(len(fmt) / wall, 3) if wall else None,
+        'items_per_second': round(words / sum(fmt), 1) if fmt and sum(fmt) else None,
+        'parse': percentiles(parse),
+        'format': percentiles(fmt),
+    }
+
+def bench_extract(workdir: str) -> Dict:
+    """Run extract_txt_from_json.py cold, then again with nothing changed."""
+    from extract_txt_from_json import extract_transcript_text
+
+    folder = os.path.join(workdir, 'json')
+    output = os.path.join(workdir, 'extract_out')
+    shutil.rmtree(output, ignore_errors=True)
+    files = sum(name.endswith('.json') for name in os.listdir(folder))
+    result = {}
+    for run in ('cold', 'incremental'):
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            extract_transcript_text(folder, output)
+        wall = time.perf_counter() - start
+        result[run] = {
+            'files': files,
+            'wall_seconds': round(wall, 3),
+            'files_per_second': round(files / wall, 3) if wall else None,
+        }
+    return result
+
+def _peak_rss_mb(who: int) -> float:
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def apply_overrides(overrides: Dict) -> None:
+    for name, value in overrides.items():
+        setattr(Config, name, value)
+
+def _child(conn, overrides: Dict, func: Callable, args: tuple) -> None:
+    apply_overrides(overrides)
+    try:
+        result = func(*args)
+        result['peak_rss_mb'] = _peak_rss_mb(resource.RUSAGE_SELF)
+        result['peak_child_rss_mb'] = _peak_rss_mb(resource.RUSAGE_CHILDREN)
+        conn.send(('ok', result))
+    except BaseException:
+        conn.send(('error', traceback.format_exc()))
+    finally:
+        conn.close()
+
+def run_isolated(overrides: Dict, func: Callable, *args) -> Dict:
+    """Run one benchmark in a fresh process, so its peak RSS is its own.
+
+    Not a multiprocessing pool: pool workers are daemonic and the pipeline
+    needs to start its own worker processes.
+    """
+    context = multiprocessing.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_child, args=(sender, overrides, func, args))
+    process.start()
+    sender.close()
+    try:
+        status, payload = receiver.recv()
+    except EOFError:
+        status, payload = 'error', f"benchmark process exited with code {process.exitcode}"
+    process.join()
+    if status != 'ok':
+        raise RuntimeError(payload)
+    return payload
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(workdir: str, corpus: str, only: List[str], overrides: Dict) -> Dict:
+    """Run the selected benchmarks and return one JSON-serialisable report."""
+    prepare_workdir(workdir, corpus)
+    settings = {
+        **PIPELINE_DEFAULTS,
+        'JOURNAL_PATH': os.path.join(workdir, 'journal.db'),
+        'SEARCH_INDEX_PATH': os.path.join(workdir, 'index.db'),
+        'FAKE_JOBS_PATH': os.path.join(workdir, 'fake_jobs.db'),
+        'METRICS_PATH': os.path.join(workdir, 'metrics.prom'),
+        # A warm cache would skip the work being measured
+        'RESULT_CACHE_DIR': None,
+        **overrides,
+    }
+    report = {
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'corpus': corpus,
+        'corpus_spec': [asdict(spec) for spec in CORPORA[corpus]],
+        'overrides': overrides,
+        'results': {},
+    }
+    results = report['results']
+    if 'compress' in only:
+        results['compress'] = {}
+        for codec, trim in COMPRESS_VARIANTS:
+            if codec != 'wav' and shutil.which('ffmpeg') is None:
+                console.print(f"[yellow]Skipping {escape(f'compress_wav[{codec}]')}: ffmpeg not found")
+                continue
+            variant = f"{codec}+vad" if trim else codec
+            console.print(escape(f"compress_wav[{variant}]..."))
+            results['compress'][variant] = run_isolated(
+                settings, bench_compress, workdir, codec, trim
+            )
+    if 'format' in only:
+        console.print("format_transcript...")
+        results['format'] = run_isolated(settings, bench_format, workdir)
+    if 'extract' in only:
+        console.print("extract_txt_from_json...")
+        results['extract'] = run_isolated(settings, bench_extract, workdir)
+    if 'pipeline' in only:
+        console.print("Transcriber.process_directory...")
+        results['pipeline'] = run_isolated(settings, bench_pipeline, workdir)
+    return report
+
+def _flatten(value, prefix: str = '') -> Dict[str, float]:
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(_flatten(item, f"{prefix}.{key}" if prefix else key))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+def compare(baseline: Dict, report: Dict) -> None:
+    """Print every metric both reports have, with the relative change."""
+    old = _flatten(baseline['results'])
+    new = _flatten(report['results'])
+    table = Table(title=f"{baseline.get('revision')} -> {report.get('revision')}")
+    table.add_column('metric')
+    table.add_column('before', justify='right')
+    table.add_column('after', justify='right')
+    table.add_column('change', justify='right')
+    for key in sorted(old.keys() & new.keys()):
+        change = f"{(new[key] - old[key]) / old[key]:+.1%}" if old[key] else ''
+        table.add_row(key, f"{old[key]:,}", f"{new[key]:,}", change)
+    console.print(table)
+
+def _parse_override(text: str):
+    name, sep, value = text.partition('=')
+    if not sep or not hasattr(Config, name):
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE with a Config setting: {text}")
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name, value
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure transcription pipeline throughput offline')
+    parser.add_argument('--corpus', choices=sorted(CORPORA), default='quick')
+    parser.add_argument('--only', default=','.join(BENCHMARKS),
+                        help=f"Comma-separated benchmarks to run (default: {','.join(BENCHMARKS)})")
+    parser.add_argument('--set', dest='overrides', metavar='NAME=VALUE', action='append',
+                        type=_parse_override, default=[],
+                        help='Override a Config setting for every benchmark (repeatable)')
+    parser.add_argument('--workdir', help='Where the corpus is generated and kept between runs '
+                                          '(default: a temporary directory, removed afterwards)')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='A previous report to print the change against')
+    args = parser.parse_args()
+    args.only = [name.strip() for name in args.only.split(',') if name.strip()]
+    unknown = set(args.only) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    return args
+
+if __name__ == '__main__':
+    args = parse_args()
+    workdir = args.workdir or tempfile.mkdtemp(prefix='transcription_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        report = run_benchmarks(os.path.abspath(workdir), args.corpus, args.only,
+                                dict(args.overrides))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=1, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            compare(json.load(f), report)
@@ -1,21 +1,120 @@
+import os
 from dataclasses import dataclass
 
 @dataclass
 class Config:
     # AWS settings
     AWS_REGION = "us-east-1"
+    S3_BUCKET = "catching-vibes-audio-transcriptions"
+    UPLOAD_PREFIX = "uploads/"  # conditioned audio, keyed by content digest
+    TRANSCRIPT_PREFIX = "transcripts/"  # result JSON location in S3_BUCKET
+    TRANSCRIBE_BACKEND = "aws"  # aws, or fake for the in-process stand-in (fake_backend.py)
+    S3_BACKEND = "aws"  # aws, or moto for an in-memory S3 (needs the moto package)
     
+    # Transcription job settings
+    TRANSCRIBE_LANGUAGE = "es-US"
+    MAX_SPEAKER_LABELS = 10
+
     # Processing settings
-    BATCH_SIZE = 100 # This is b/c of the 100 item limit in DynamoDB batch size
+    MAX_CONCURRENT_JOBS = 100  # ceiling of the adaptive job window; set to the account quota
+    INITIAL_CONCURRENT_JOBS = 5  # job window at start, grown until Transcribe throttles
+    CONDITION_WORKERS = os.cpu_count() or 1  # processes downmixing/resampling WAVs
+    UPLOAD_WORKERS = 16  # ceiling of the adaptive upload window (threads)
+    INITIAL_UPLOAD_WORKERS = 4  # upload window at start, grown until S3 throttles
+    STAGE_QUEUE_SIZE = 8  # items buffered between pipeline stages
+    PREFLIGHT_WORKERS = 16  # threads reading WAV headers as files are discovered
+    SCHEDULE_WINDOW = 256  # discovered files held for longest-first ordering
+
+    # Upload settings
+    UPLOAD_CODEC = "wav"  # wav, flac or ogg (Opus); flac/ogg are encoded with ffmpeg
+    OPUS_BITRATE = "32k"
+    # Pipe conditioned audio straight into S3 (needs os.mkfifo). The content digest is
+    # then only known after the transfer, so audio already in S3 is sent again (and
+    # discarded); turn off to check before uploading.
+    STREAM_UPLOADS = True
+    MULTIPART_CHUNK_SIZE = 16 * 1024 * 1024  # bytes per multipart part
+    MULTIPART_CONCURRENCY = 4  # parts in flight per upload
+    SCRATCH_DIR = None  # where pipes/temp files go; None uses the system default
+    MAX_RETRIES = 12  # consecutive failed status refreshes before giving up
+
+    # Throttling: adaptive job/upload windows and retries of throttled calls
+    AIMD_DECREASE = 0.5  # window multiplier on throttling
+    AIMD_COOLDOWN = 5  # seconds; throttles this soon after a decrease don't shrink it again
+    THROTTLE_RETRIES = 8  # attempts after the first for a throttled call
+    THROTTLE_BACKOFF_BASE = 1.0  # seconds, doubled per attempt
+    THROTTLE_BACKOFF_MAX = 60  # seconds
 
-    MAX_CONCURRENT_JOBS = 5
-    MAX_RETRIES = 12
-    RETRY_DELAY = 5  # seconds
+    # Fake transcription backend (TRANSCRIBE_BACKEND = "fake")
+    FAKE_JOB_LATENCY = 2.0  # seconds a job runs
+    FAKE_LATENCY_JITTER = 0.5  # +/- fraction applied to each job's latency
+    FAKE_FAILURE_RATE = 0.0  # fraction of jobs that finish FAILED
+    FAKE_THROTTLE_RATE = 0.0  # fraction of calls rejected with ThrottlingException
+    FAKE_MAX_CONCURRENT_JOBS = 100  # running jobs beyond this get LimitExceededException
+    FAKE_WORDS_PER_JOB = 200
+    FAKE_JOBS_PATH = "fake_transcribe_jobs.db"  # kept like the journal, so reruns can reattach; None keeps them in memory
+
+    # Job status polling
+    JOB_NAME_PREFIX = "transcription_"
+    POLL_MIN_INTERVAL = 5  # seconds
+    POLL_MAX_INTERVAL = 60  # seconds
+    POLL_BACKOFF = 1.5  # interval growth while no job finishes
+    POLL_JITTER = 0.2  # +/- fraction applied to each poll delay
+    EXPECTED_TRANSCRIBE_RATIO = 0.25  # job runtime per second of audio, roughly
+    JOB_TIMEOUT = 6 * 3600  # seconds
+    POLL_VERIFY_CYCLES = 5  # refreshes that finish nothing before overdue jobs are looked up one by one
     
+    # Voice-activity trimming: drop long silences before upload
+    VAD_ENABLED = False
+    VAD_FRAME_MS = 30
+    VAD_THRESHOLD_DB = -50  # frame energy (dBFS) above which a frame is speech
+    VAD_MIN_SILENCE = 3.0  # seconds; shorter silences are kept whole
+    VAD_PADDING = 0.5  # seconds of silence kept either side of speech
+
+    # Long-recording splitting: chunks transcribed as parallel jobs
+    SPLIT_LONG_RECORDINGS = False
+    SPLIT_THRESHOLD = 30 * 60  # seconds of audio before a file is split
+    SPLIT_CHUNK_LENGTH = 10 * 60  # target seconds per chunk
+    SPLIT_SEARCH_WINDOW = 60  # seconds either side of a target to look for silence
+    SPLIT_OVERLAP = 20  # seconds shared by neighbouring chunks, to match speakers
+
+    # Instrumentation (telemetry.py)
+    TRACE_PATH = None  # JSON-lines trace of every timed span; None disables it
+    METRICS_PATH = "transcription_metrics.prom"  # Prometheus text file; None disables it
+    METRICS_INTERVAL = 30  # seconds between rewrites of METRICS_PATH during a run
+    PROFILE_DIR = None  # cProfile dumps of each conditioning/splitting call; None disables it
+
+    # Distributed runs: a coordinator enqueues files, workers on any node claim them
+    QUEUE_BACKEND = "sqlite"
+    QUEUE_PATH = "transcription_queue.db"  # must be on storage every node mounts
+    QUEUE_LEASE_SECONDS = 300  # a claim is returned to the queue unless renewed within this
+    QUEUE_HEARTBEAT_INTERVAL = 60  # seconds between lease renewals
+    QUEUE_POLL_INTERVAL = 10  # seconds a worker waits when nothing is claimable
+    QUEUE_MAX_ATTEMPTS = 3  # claims of one file before it is marked failed
+
+    # Result cache: finished results keyed by conditioned-audio digest and job settings
+    RESULT_CACHE_DIR = ".transcription_cache"  # None disables it
+    RESULT_CACHE_MAX_BYTES = 2 * 1024 ** 3  # least recently used entries go past this
+    RESULT_CACHE_S3_PREFIX = None  # e.g. "cache/" to mirror entries in S3_BUCKET
+
+    # Run journal (resume state)
+    JOURNAL_BACKEND = "sqlite"
+    JOURNAL_PATH = "transcription_journal.db"
+    SOURCE_SAMPLE_BLOCKS = 32  # blocks hashed, besides the first and last, to tell sources apart
+    SOURCE_SAMPLE_SIZE = 64 * 1024  # bytes per sampled block
+
     # Audio settings
     TARGET_SAMPLE_RATE = 16000
     TARGET_CHANNELS = 1
     COMPRESSION_QUALITY = 0.7
+    CHUNK_FRAMES = 65536  # frames read per block while conditioning
     
     # Output settings
-    TIMESTAMP_FORMAT = "%Y%m%d_%H%M%S"
+    SAVE_TRANSCRIPT_STORE = True  # also write word timings as a .tstore (transcript_store.py)
+    SEARCH_INDEX_PATH = "transcript_index.db"  # timecoded full-text index; None disables it
+    EXPORT_FORMATS = ("srt", "vtt", "json", "edl")  # written next to each .txt (exporters.py)
+    EXPORT_FPS = 25  # frame rate of EDL marker timecodes
+    EXPORT_TIMELINE_START = 3600  # seconds added to EDL markers (01:00:00:00)
+    SUBTITLE_LINE_CHARS = 42
+    SUBTITLE_MAX_LINES = 2
+    SUBTITLE_MAX_SECONDS = 7.0  # longest a subtitle stays on screen
+    SUBTITLE_MAX_GAP = 1.0  # seconds of pause that start a new subtitle
@@ -0,0 +1,66 @@
+import os
+import wave
+from dataclasses import dataclass
+from typing import Iterator
+from rich.console import Console
+
+console = Console()
+
+def create_parallel_output_dir(input_path: str, base_output_dir: str) -> str:
+    """Create parallel output directory structure."""
+    rel_path = os.path.relpath(input_path, base_output_dir)
+    output_path = os.path.join(base_output_dir, "transcripts", rel_path)
+    os.makedirs(output_path, exist_ok=True)
+    return output_path
+
+def iter_wav_files(root: str) -> Iterator[str]:
+    """Yield WAV files under root as the tree is walked, without listing it first."""
+    pending = [root]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except OSError as e:
+            console.print(f"[yellow]Cannot read directory: {str(e)}")
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                        continue
+                    is_wav = entry.name.lower().endswith('.wav') and entry.is_file()
+                except OSError as e:
+                    console.print(f"[yellow]Cannot read {entry.path}: {str(e)}")
+                    continue
+                if is_wav:
+                    yield entry.path
+
+@dataclass
+class AudioInfo:
+    """What a WAV header says about a file."""
+    path: str
+    duration: float
+    rate: int
+    channels: int
+    frames: int
+    size: int
+
+def probe_wav(path: str) -> AudioInfo:
+    """Read only the header of a WAV file; raise ValueError if it is unusable."""
+    try:
+        with wave.open(path, 'rb') as wav_in:
+            channels = wav_in.getnchannels()
+            width = wav_in.getsampwidth()
+            rate = wav_in.getframerate()
+            frames = wav_in.getnframes()
+    except (wave.Error, EOFError) as e:
+        raise ValueError(f"not a readable PCM WAV file: {str(e) or type(e).__name__}")
+
+    size = os.path.getsize(path)
+    if width not in (1, 2, 3, 4):
+        raise ValueError(f"unsupported sample width: {width} bytes")
+    if rate <= 0 or frames == 0:
+        raise ValueError("no audio frames")
+    if size < frames * channels * width:
+        raise ValueError("truncated: header claims more audio than the file holds")
+    return AudioInfo(path, frames / float(rate), rate, channels, frames, size)
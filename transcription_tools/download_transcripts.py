@@ -1,49 +1,203 @@
-import boto3
-import requests
+import argparse
+import json
 import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+import requests
+from requests.adapters import HTTPAdapter
+from aws_session import get_client, parse_s3_uri
+
+MANIFEST_NAME = ".manifest.json"
+DEFAULT_WORKERS = 16
+
+def list_completed_jobs(transcribe_client, since=None, name_contains=None):
+    """
+    Yield summaries of COMPLETED jobs, newest first, filtered by the service.
+    With `since`, stop paging at the first job created before it.
+    """
+    kwargs = {"Status": "COMPLETED", "MaxResults": 100}
+    if name_contains:
+        kwargs["JobNameContains"] = name_contains
+    while True:
+        response = transcribe_client.list_transcription_jobs(**kwargs)
+        for summary in response.get("TranscriptionJobSummaries", []):
+            if since is not None and summary["CreationTime"] < since:
+                return
+            yield summary
+        if "NextToken" not in response:
+            return
+        kwargs["NextToken"] = response["NextToken"]
+
+def load_manifest(output_dir):
+    """
+    Return {job_name: {"size": ..., "etag": ..., "completed": ...}} for
+    transcripts downloaded before.
+    """
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_manifest(output_dir, manifest):
+    _write_atomic(
+        os.path.join(output_dir, MANIFEST_NAME),
+        [json.dumps(manifest, indent=1, sort_keys=True).encode("utf-8")]
+    )
+
+def completion_stamp(summary):
+    return summary["CompletionTime"].isoformat() if summary.get("CompletionTime") else None
+
+def is_downloaded(local_file, record, summary):
+    """
+    A transcript is done if the local file is the size recorded when it was
+    downloaded and the job is the one that was downloaded. A job re-run
+    under the same name has a new completion time, so its result is fetched
+    again even when it happens to be the same size; other completed jobs
+    never change, so there is no need to ask AWS.
+    """
+    if record is None or not os.path.exists(local_file):
+        return False
+    completed = record.get("completed")
+    if completed is None or completed != completion_stamp(summary):
+        return False
+    return os.path.getsize(local_file) == record["size"]
+
+def _write_atomic(path, chunks):
+    """
+    Write chunks to a temp file next to `path` and rename it into place, so an
+    interrupted run never leaves a truncated file under the final name.
+    Returns the number of bytes written.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".part")
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return size
+
+def download_transcript(transcribe_client, s3_client, session, job_name, local_file,
+                        record=None):
+    """
+    Fetch one job's transcript into local_file; return its manifest record.
+    Results in our own bucket are read through S3, service-managed ones
+    through their presigned URL. A local file already there (e.g. from an
+    older run) is kept if S3 reports the same size for it and, when
+    `record` has one, the same ETag.
+    """
+    job = transcribe_client.get_transcription_job(TranscriptionJobName=job_name)
+    transcript_uri = job["TranscriptionJob"]["Transcript"]["TranscriptFileUri"]
 
-def list_and_download_all_transcripts(output_dir="transcripts"):
+    location = parse_s3_uri(transcript_uri)
+    if location is not None:
+        bucket, key = location
+        if os.path.exists(local_file):
+            head = s3_client.head_object(Bucket=bucket, Key=key)
+            etag = head.get("ETag", "").strip('"')
+            known_etag = (record or {}).get("etag")
+            if (head["ContentLength"] == os.path.getsize(local_file)
+                    and (not known_etag or known_etag == etag)):
+                return {"size": head["ContentLength"], "etag": etag}
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        etag = response.get("ETag", "").strip('"')
+        size = _write_atomic(local_file, response["Body"].iter_chunks(1024 * 1024))
+    else:
+        with session.get(transcript_uri, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            etag = response.headers.get("ETag", "").strip('"')
+            size = _write_atomic(local_file, response.iter_content(1024 * 1024))
+    return {"size": size, "etag": etag}
+
+def list_and_download_all_transcripts(output_dir="transcripts", since=None,
+                                      workers=DEFAULT_WORKERS, name_contains=None):
     """
-    List all Amazon Transcribe jobs in the account, and download their transcripts
-    to a specified output directory (defaults to 'transcripts' if not provided).
+    Download the transcript of every COMPLETED Amazon Transcribe job in the
+    account into output_dir, `workers` at a time.
+
+    Runs are incremental: a manifest in output_dir records the size, ETag
+    and job completion time of each transcript written, and jobs whose file
+    is still there at that size, from the same completed job, are skipped.
+    With `since` (a datetime), only jobs created at or after it are
+    considered.
     """
 
     # Create output directory if it doesn't exist
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    transcribe_client = boto3.client('transcribe')
-    
-    # Collect all transcription jobs using pagination
-    all_jobs = []
-    response = transcribe_client.list_transcription_jobs(MaxResults=100)
-    all_jobs.extend(response.get('TranscriptionJobSummaries', []))
-    
-    while "NextToken" in response:
-        response = transcribe_client.list_transcription_jobs(
-            MaxResults=100,
-            NextToken=response["NextToken"]
-        )
-        all_jobs.extend(response.get('TranscriptionJobSummaries', []))
-    
-    # Iterate over each transcription job and download its transcript
-    for job_summary in all_jobs:
-        job_name = job_summary["TranscriptionJobName"]
-        job_details = transcribe_client.get_transcription_job(TranscriptionJobName=job_name)
-        
-        # Get the transcript file URI
-        transcript_uri = job_details["TranscriptionJob"]["Transcript"]["TranscriptFileUri"]
-        
-        # Download the transcript data
-        print(f"Downloading transcript for job: {job_name}")
-        response = requests.get(transcript_uri)
-        
-        # Save to a local JSON file named after the job
-        local_file = os.path.join(output_dir, f"{job_name}.json")
-        with open(local_file, "wb") as f:
-            f.write(response.content)
-        
-        print(f"Saved transcript to: {local_file}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Shared clients whose connection pools are large enough for every worker
+    transcribe_client = get_client("transcribe", pool_size=workers)
+    s3_client = get_client("s3", pool_size=workers)
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=workers, pool_maxsize=workers))
+
+    manifest = load_manifest(output_dir)
+    manifest_lock = threading.Lock()
+    downloaded = skipped = failed = 0
+
+    def fetch(job_name, local_file, summary):
+        record = download_transcript(transcribe_client, s3_client, session, job_name,
+                                     local_file, manifest.get(job_name))
+        record["completed"] = completion_stamp(summary)
+        with manifest_lock:
+            manifest[job_name] = record
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for summary in list_completed_jobs(transcribe_client, since, name_contains):
+                job_name = summary["TranscriptionJobName"]
+                local_file = os.path.join(output_dir, f"{job_name}.json")
+                if is_downloaded(local_file, manifest.get(job_name), summary):
+                    skipped += 1
+                    continue
+                futures[pool.submit(fetch, job_name, local_file, summary)] = job_name
+
+            for future in as_completed(futures):
+                job_name = futures[future]
+                try:
+                    future.result()
+                    downloaded += 1
+                    print(f"Saved transcript for job: {job_name}")
+                except Exception as e:
+                    failed += 1
+                    print(f"Failed to download transcript for job {job_name}: {str(e)}")
+    finally:
+        # Keep what was downloaded even if the run is interrupted
+        with manifest_lock:
+            save_manifest(output_dir, manifest)
+        session.close()
+
+    print(f"Downloaded {downloaded}, already up to date {skipped}, failed {failed}.")
+
+def parse_since(value):
+    """
+    Parse an ISO 8601 date or datetime; naive values are taken as UTC.
+    """
+    since = datetime.fromisoformat(value)
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return since
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Download Amazon Transcribe transcripts")
+    parser.add_argument("output_dir", nargs="?", default="transcripts",
+                        help="Directory for the transcript JSON files")
+    parser.add_argument("--since", type=parse_since,
+                        help="Only jobs created at or after this ISO date/time")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Transcripts downloaded in parallel")
+    parser.add_argument("--contains", dest="name_contains",
+                        help="Only jobs whose name contains this text")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    list_and_download_all_transcripts()
+    args = parse_args()
+    list_and_download_all_transcripts(args.output_dir, args.since, args.workers, args.name_contains)
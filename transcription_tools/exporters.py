@@ -0,0 +1,244 @@
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, TextIO
+from config import Config
+from transcript_store import ColumnarTranscript
+
+@dataclass
+class Word:
+    text: str
+    start_ms: int
+    end_ms: int
+    confidence: float
+
+@dataclass
+class Cue:
+    """One subtitle: consecutive words from one speaker, already broken into lines."""
+    index: int
+    speaker: Optional[str]
+    words: List[Word] = field(default_factory=list)
+    lines: List[str] = field(default_factory=list)
+
+    @property
+    def start(self) -> float:
+        return self.words[0].start_ms / 1000
+
+    @property
+    def end(self) -> float:
+        return self.words[-1].end_ms / 1000
+
+    @property
+    def text(self) -> str:
+        return ' '.join(self.lines)
+
+def iter_cues(transcript: ColumnarTranscript) -> Iterator[Cue]:
+    """Group words into subtitle cues, breaking lines as the words arrive.
+
+    A word goes on the current line while it fits in Config.SUBTITLE_LINE_CHARS,
+    else on a new line; a cue closes when it would need more than
+    Config.SUBTITLE_MAX_LINES lines or run past Config.SUBTITLE_MAX_SECONDS,
+    and before a speaker change, a pause of Config.SUBTITLE_MAX_GAP or a word
+    following the end of a sentence. Punctuation joins the word before it.
+    """
+    strings = transcript.strings()
+    words = transcript.word.tolist()
+    punctuation = transcript.punctuation.tolist()
+    # Converted once, vectorised, rather than per word
+    starts = transcript.start_ms.tolist()
+    ends = transcript.end_ms.tolist()
+    confidences = transcript.confidence.astype(float).round(4).tolist()
+    max_gap = Config.SUBTITLE_MAX_GAP * 1000
+    max_length = Config.SUBTITLE_MAX_SECONDS * 1000
+    speakers = transcript.speaker.tolist()
+
+    cue: Optional[Cue] = None
+    sentence_ended = False
+    index = 0
+    for i in range(len(words)):
+        content = strings[words[i]]
+        if punctuation[i]:
+            if cue is not None:
+                cue.words[-1].text += content
+                cue.lines[-1] += content
+                sentence_ended = content in '.?!'
+            continue
+
+        word = Word(content, starts[i], ends[i], confidences[i])
+        speaker = transcript.speakers[speakers[i]] if speakers[i] >= 0 else None
+        line_fits = (cue is not None and
+                     len(cue.lines[-1]) + 1 + len(content) <= Config.SUBTITLE_LINE_CHARS)
+        if cue is not None and (
+                speaker != cue.speaker
+                or sentence_ended
+                or word.start_ms - cue.words[-1].end_ms > max_gap
+                or word.end_ms - cue.words[0].start_ms > max_length
+                or (not line_fits and len(cue.lines) >= Config.SUBTITLE_MAX_LINES)):
+            yield cue
+            cue = None
+        sentence_ended = False
+
+        if cue is None:
+            index += 1
+            cue = Cue(index, speaker, [word], [content])
+        elif line_fits:
+            cue.words.append(word)
+            cue.lines[-1] += ' ' + content
+        else:
+            cue.words.append(word)
+            cue.lines.append(content)
+    if cue is not None:
+        yield cue
+
+def _clock(seconds: float, separator: str) -> str:
+    ms = int(round(seconds * 1000))
+    hours, ms = divmod(ms, 3600000)
+    minutes, ms = divmod(ms, 60000)
+    secs, ms = divmod(ms, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{ms:03d}"
+
+def _timecode(frames: int) -> str:
+    """Non-drop-frame SMPTE timecode at Config.EXPORT_FPS."""
+    secs, frame = divmod(frames, Config.EXPORT_FPS)
+    minutes, secs = divmod(secs, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}:{frame:02d}"
+
+class _SrtWriter:
+    def __init__(self, f: TextIO, title: str):
+        self.f = f
+
+    def cue(self, cue: Cue) -> None:
+        self.f.write(f"{cue.index}\n{_clock(cue.start, ',')} --> {_clock(cue.end, ',')}\n")
+        self.f.write('\n'.join(cue.lines) + '\n\n')
+
+    def close(self) -> None:
+        pass
+
+class _VttWriter:
+    def __init__(self, f: TextIO, title: str):
+        self.f = f
+        f.write("WEBVTT\n\n")
+
+    def cue(self, cue: Cue) -> None:
+        self.f.write(f"{_clock(cue.start, '.')} --> {_clock(cue.end, '.')}\n")
+        voice = f"<v {cue.speaker}>" if cue.speaker else ''
+        self.f.write(voice + '\n'.join(cue.lines) + '\n\n')
+
+    def close(self) -> None:
+        pass
+
+class _JsonWriter:
+    """Streams {"title", "cues": [...]} one cue at a time.
+
+    Times are integer milliseconds and each cue carries its words as
+    [text, start_ms, end_ms, confidence] arrays, which encode several times
+    faster than one object of float seconds per word.
+    """
+
+    def __init__(self, f: TextIO, title: str):
+        self.f = f
+        self.first = True
+        f.write('{"title": ' + json.dumps(title) + ', "cues": [')
+
+    def cue(self, cue: Cue) -> None:
+        self.f.write(('\n' if self.first else ',\n') + json.dumps({
+            'index': cue.index,
+            'speaker': cue.speaker,
+            'start_ms': cue.words[0].start_ms,
+            'end_ms': cue.words[-1].end_ms,
+            'text': cue.text,
+            'words': [[w.text, w.start_ms, w.end_ms, w.confidence] for w in cue.words],
+        }, ensure_ascii=False))
+        self.first = False
+
+    def close(self) -> None:
+        self.f.write('\n]}\n')
+
+class _EdlWriter:
+    """DaVinci Resolve marker EDL: one marker per speaker turn.
+
+    Resolve imports these through Timeline > Import > Timeline Markers from
+    EDL. Marker times are offset by Config.EXPORT_TIMELINE_START, since
+    Resolve timelines start at 01:00:00:00 by default.
+    """
+
+    def __init__(self, f: TextIO, title: str):
+        self.f = f
+        self.count = 0
+        self.speaker: Optional[str] = None
+        self.start = self.end = 0.0
+        self.text: List[str] = []
+        f.write(f"TITLE: {title}\nFCM: NON-DROP FRAME\n\n")
+
+    def cue(self, cue: Cue) -> None:
+        if self.text and cue.speaker != self.speaker:
+            self._marker()
+        if not self.text:
+            self.speaker, self.start = cue.speaker, cue.start
+        self.end = cue.end
+        self.text.append(cue.text)
+
+    def _marker(self) -> None:
+        self.count += 1
+        start = self.start + Config.EXPORT_TIMELINE_START
+        frames = max(1, int(round((self.end - self.start) * Config.EXPORT_FPS)))
+        name = ' '.join(self.text)
+        if len(name) > 80:
+            name = name[:77] + '...'
+        label = f"{self.speaker}: {name}" if self.speaker else name
+        in_frame = int(round(start * Config.EXPORT_FPS))
+        in_tc, out_tc = _timecode(in_frame), _timecode(in_frame + 1)
+        self.f.write(f"{self.count:03d}  001      V     C        "
+                     f"{in_tc} {out_tc} {in_tc} {out_tc}  \n")
+        self.f.write(f" |C:ResolveColorBlue |M:{label.replace('|', '/')} |D:{frames}\n\n")
+        self.text = []
+
+    def close(self) -> None:
+        if self.text:
+            self._marker()
+
+WRITERS = {
+    'srt': _SrtWriter,
+    'vtt': _VttWriter,
+    'json': _JsonWriter,
+    'edl': _EdlWriter,
+}
+
+def export_transcript(transcript: ColumnarTranscript, base_path: str, title: str,
+                      formats=None) -> List[str]:
+    """Write base_path + '.<format>' for each format in one pass over the items.
+
+    The cues are computed once and handed to every writer as they are
+    produced, so each extra format only adds its own formatting cost.
+    Returns the paths written.
+    """
+    formats = Config.EXPORT_FORMATS if formats is None else formats
+    unknown = set(formats) - set(WRITERS)
+    if unknown:
+        raise ValueError(f"Unsupported export format(s): {', '.join(sorted(unknown))}")
+
+    files: Dict[str, TextIO] = {}
+    try:
+        for name in formats:
+            files[name] = open(f"{base_path}.{name}.part", 'w', encoding='utf-8')
+        writers = [WRITERS[name](files[name], title) for name in formats]
+        for cue in iter_cues(transcript):
+            for writer in writers:
+                writer.cue(cue)
+        for writer in writers:
+            writer.close()
+    except BaseException:
+        for name, f in files.items():
+            f.close()
+            os.remove(f"{base_path}.{name}.part")
+        raise
+    for f in files.values():
+        f.close()
+
+    paths = []
+    for name in formats:
+        path = f"{base_path}.{name}"
+        os.replace(f"{path}.part", path)
+        paths.append(path)
+    return paths
@@ -1,56 +1,197 @@
-import os
+import argparse
+import hashlib
 import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+STATE_NAME = ".extract_state.json"
+
+def transcript_text(raw):
+    """
+    Return the combined text of data["results"]["transcripts"] from a
+    Transcribe result, one transcript per line.
+
+    Only the `transcripts` list is decoded: Transcribe writes it before the
+    per-word `items`, so the (much larger) items tree is never built. The
+    string "transcripts" can also occur earlier (as a word, say), so the
+    shortcut is only trusted if it decodes to transcript entries; anything
+    else falls back to a full parse.
+    """
+    results = raw.find('"results"')
+    start = raw.find('"transcripts"', results) if results != -1 else -1
+    transcripts_list = None
+    if start != -1:
+        bracket = raw.find('[', start)
+        try:
+            transcripts_list, _ = json.JSONDecoder().raw_decode(raw, bracket)
+        except ValueError:
+            transcripts_list = None
+    if not is_transcripts_list(transcripts_list):
+        transcripts_list = json.loads(raw).get("results", {}).get("transcripts", [])
+
+    # Combine all transcript text into a single string
+    return "\n".join(t.get("transcript", "") for t in transcripts_list)
+
+def is_transcripts_list(value):
+    """True for a non-empty list of {"transcript": ...} entries."""
+    return (isinstance(value, list) and bool(value)
+            and all(isinstance(t, dict) and "transcript" in t for t in value))
+
+def short_name(filename):
+    """
+    Build the preferred output filename:
+    e.g., "transcription_CasaRetablo-001_06102354739509227.json"
+    -> "transcription_CasaRetablo-001.txt"
+    """
+    base_name = os.path.splitext(filename)[0]  # remove .json
+    # Split at underscores, keep only the first two parts, then add .txt
+    # (Assumes a naming convention like "transcription_<something>_<numbers>.json")
+    parts = base_name.split("_")
+    if len(parts) > 2:
+        return "_".join(parts[:2]) + ".txt"
+    return base_name + ".txt"
+
+def assign_output_names(filenames, state):
+    """
+    Map each JSON filename to a .txt name that no other source uses.
+
+    Names already given out in earlier runs are kept. A new file gets the
+    short name unless another source already has it, in which case it gets
+    its full base name. That can be the short name too (two-part names), so
+    a numbered suffix is added until the name is free.
+    """
+    names = {filename: state[filename]["output"] for filename in filenames if filename in state}
+    taken = set(names.values())
+    for filename in sorted(filenames):
+        if filename in names:
+            continue
+        name = short_name(filename)
+        if name in taken:
+            base_name = os.path.splitext(filename)[0]
+            name = base_name + ".txt"
+            suffix = 2
+            while name in taken:
+                name = f"{base_name}-{suffix}.txt"
+                suffix += 1
+        names[filename] = name
+        taken.add(name)
+    return names
+
+def extract_one(json_path, output_path, previous_hash):
+    """
+    Write the transcript text of one JSON file unless its content hash is
+    previous_hash and the output exists. Returns (hash, wrote).
+    """
+    with open(json_path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    if digest == previous_hash and os.path.exists(output_path):
+        return digest, False
 
-def extract_transcript_text(json_folder="transcripts", output_folder="txtfiles"):
+    combined_transcript = transcript_text(raw.decode("utf-8"))
+    temp_path = output_path + ".part"
+    with open(temp_path, "w", encoding="utf-8") as txt_file:
+        txt_file.write(combined_transcript)
+    os.replace(temp_path, output_path)
+    return digest, True
+
+def load_state(output_folder):
+    path = os.path.join(output_folder, STATE_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_state(output_folder, state):
+    path = os.path.join(output_folder, STATE_NAME)
+    with open(path + ".part", "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(path + ".part", path)
+
+def extract_transcript_text(json_folder="transcripts", output_folder="txtfiles", workers=None):
     """
-    Reads all JSON files in 'json_folder', extracts the combined transcript text,
-    and saves it into .txt files.
+    Reads the JSON files in 'json_folder', extracts the combined transcript text,
+    and saves it into .txt files, in a pool of `workers` processes
+    (default: one per CPU; 1 runs in this process).
+
+    Runs are incremental: files whose size and mtime match the last run are
+    not opened, and files that were touched but whose content hash is
+    unchanged are not rewritten.
     """
-    
+
     # Make sure the folder exists
     if not os.path.isdir(json_folder):
         print(f"Directory '{json_folder}' does not exist.")
         return
+    os.makedirs(output_folder, exist_ok=True)
+
+    state = load_state(output_folder)
+    with os.scandir(json_folder) as entries:
+        stats = {entry.name: entry.stat() for entry in entries
+                 if entry.name.endswith(".json") and entry.is_file()
+                 # Skip dotfiles such as download_transcripts.py's manifest
+                 and not entry.name.startswith(".")}
+    names = assign_output_names(list(stats), state)
+
+    pending = []
+    for filename, stat in stats.items():
+        record = state.get(filename)
+        output_path = os.path.join(output_folder, names[filename])
+        if (record is not None and record["mtime_ns"] == stat.st_mtime_ns
+                and record["size"] == stat.st_size and os.path.exists(output_path)):
+            continue
+        pending.append((filename, output_path, record["hash"] if record else None))
+
+    written = 0
+
+    def finished(filename, extract):
+        nonlocal written
+        try:
+            digest, wrote = extract()
+        except Exception as e:
+            print(f"Failed to extract {filename}: {str(e)}")
+            return
+        stat = stats[filename]
+        state[filename] = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "hash": digest,
+            "output": names[filename],
+        }
+        if wrote:
+            written += 1
+            print(f"Wrote transcript text to: {os.path.join(output_folder, names[filename])}")
+
+    try:
+        if workers == 1 or len(pending) <= 1:
+            for filename, output_path, previous_hash in pending:
+                json_path = os.path.join(json_folder, filename)
+                finished(filename, lambda: extract_one(json_path, output_path, previous_hash))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [
+                    (filename, pool.submit(extract_one, os.path.join(json_folder, filename),
+                                           output_path, previous_hash))
+                    for filename, output_path, previous_hash in pending
+                ]
+                for filename, future in futures:
+                    finished(filename, future.result)
+    finally:
+        # Forget sources that were deleted, and keep progress if interrupted
+        for filename in set(state) - set(stats):
+            del state[filename]
+        save_state(output_folder, state)
+
+    print(f"Checked {len(stats)} files, wrote {written}.")
 
-    for filename in os.listdir(json_folder):
-        if filename.endswith(".json"):
-            json_path = os.path.join(json_folder, filename)
-            
-            # Load the JSON data
-            with open(json_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            
-            # Extract the transcripts list:
-            # data["results"]["transcripts"] should be a list of dicts,
-            # each with a "transcript" key
-            transcripts_list = data.get("results", {}).get("transcripts", [])
-            
-            # Combine all transcript text into a single string
-            combined_transcript = "\n".join(
-                t.get("transcript", "") for t in transcripts_list
-            )
-
-            # Build the new output filename:
-            # e.g., "transcription_CasaRetablo-001_06102354739509227.json"
-            # -> "transcription_CasaRetablo-001.txt"
-            base_name = os.path.splitext(filename)[0]  # remove .json
-            # Split at underscores, keep only the first two parts, then add .txt
-            # (Assumes a naming convention like "transcription_<something>_<numbers>.json")
-            parts = base_name.split("_")
-            if len(parts) > 2:
-                # Reconstruct everything up to the second underscore
-                output_filename = "_".join(parts[:2]) + ".txt"
-            else:
-                # If there's only one underscore or fewer, just replace extension with .txt
-                output_filename = base_name + ".txt"
-            
-            output_path = os.path.join(output_folder, output_filename)
-            
-            # Write the combined transcript to a .txt file
-            with open(output_path, "w", encoding="utf-8") as txt_file:
-                txt_file.write(combined_transcript)
-            
-            print(f"Wrote transcript text to: {output_path}")
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extract plain text from Transcribe JSON results")
+    parser.add_argument("json_folder", nargs="?", default="transcripts")
+    parser.add_argument("output_folder", nargs="?", default="txtfiles")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Processes to use (default: one per CPU; 1 disables the pool)")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    extract_transcript_text("transcripts", "txtfiles")
+    args = parse_args()
+    extract_transcript_text(args.json_folder, args.output_folder, args.workers)
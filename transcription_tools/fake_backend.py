@@ -0,0 +1,210 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Optional, Tuple
+from botocore.exceptions import ClientError
+from backends import JobStatus, TranscriptionBackend
+from config import Config
+
+_WORDS = ("hola", "bueno", "entonces", "la", "casa", "del", "retablo", "pues",
+          "sí", "claro", "música", "noche", "que", "y", "mi", "abuela")
+
+def _client_error(code: str, operation: str) -> ClientError:
+    return ClientError({'Error': {'Code': code, 'Message': f"Simulated {code}"}}, operation)
+
+@dataclass
+class _FakeJob:
+    media_uri: str
+    created: datetime
+    done_at: float  # time.time() the job finishes
+    failed: bool
+
+class FakeTranscribeBackend(TranscriptionBackend):
+    """In-process stand-in for Amazon Transcribe, for offline runs and benchmarks.
+
+    Jobs finish after Config.FAKE_JOB_LATENCY (with jitter) and a
+    Config.FAKE_FAILURE_RATE share of them fail. Submitting beyond
+    Config.FAKE_MAX_CONCURRENT_JOBS running jobs raises
+    LimitExceededException and any call may raise ThrottlingException at
+    Config.FAKE_THROTTLE_RATE, as botocore ClientErrors, so the adaptive
+    windows react as they would against the real service. Results are
+    Transcribe-shaped JSON generated on fetch. Jobs are kept in a SQLite
+    file at `jobs_path` (default Config.FAKE_JOBS_PATH), so a later run can
+    reattach to the jobs its journal names, as it would with Transcribe.
+    """
+
+    def __init__(self, seed: Optional[int] = None, jobs_path: Optional[str] = None):
+        self.jobs: Dict[str, _FakeJob] = {}
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.throttled = 0
+        self.conn = None
+        jobs_path = jobs_path or Config.FAKE_JOBS_PATH
+        if jobs_path:
+            self.conn = sqlite3.connect(jobs_path, check_same_thread=False)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    name TEXT PRIMARY KEY,
+                    media_uri TEXT NOT NULL,
+                    created TEXT NOT NULL,
+                    done_at REAL NOT NULL,
+                    failed INTEGER NOT NULL
+                )
+            """)
+            self.conn.commit()
+            for name, media_uri, created, done_at, failed in self.conn.execute(
+                    "SELECT name, media_uri, created, done_at, failed FROM jobs"):
+                self.jobs[name] = _FakeJob(media_uri, datetime.fromisoformat(created),
+                                           done_at, bool(failed))
+
+    def _call(self, operation: str) -> None:
+        """Count a call and maybe throttle it; must hold self.lock."""
+        self.calls += 1
+        if self.random.random() < Config.FAKE_THROTTLE_RATE:
+            self.throttled += 1
+            raise _client_error('ThrottlingException', operation)
+
+    def submit(self, job_name: str, media_uri: str) -> Tuple[str, datetime]:
+        with self.lock:
+            self._call('StartTranscriptionJob')
+            now = time.time()
+            running = sum(1 for job in self.jobs.values() if job.done_at > now)
+            if running >= Config.FAKE_MAX_CONCURRENT_JOBS:
+                self.throttled += 1
+                raise _client_error('LimitExceededException', 'StartTranscriptionJob')
+
+            submitted_name = f"{job_name}_{self.random.getrandbits(48)}"
+            jitter = self.random.uniform(1 - Config.FAKE_LATENCY_JITTER,
+                                         1 + Config.FAKE_LATENCY_JITTER)
+            created = datetime.now(timezone.utc)
+            job = self.jobs[submitted_name] = _FakeJob(
+                media_uri=media_uri,
+                created=created,
+                done_at=now + Config.FAKE_JOB_LATENCY * jitter,
+                failed=self.random.random() < Config.FAKE_FAILURE_RATE,
+            )
+            if self.conn is not None:
+                self.conn.execute(
+                    "INSERT INTO jobs (name, media_uri, created, done_at, failed) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (submitted_name, media_uri, created.isoformat(), job.done_at, int(job.failed))
+                )
+                self.conn.commit()
+            return submitted_name, created
+
+    def status_batch(self, jobs: Dict[str, datetime]) -> Dict[str, JobStatus]:
+        with self.lock:
+            self._call('ListTranscriptionJobs')
+            now = time.time()
+            finished = {}
+            for name in jobs:
+                job = self.jobs.get(name)
+                if job is None or job.done_at > now:
+                    continue
+                finished[name] = self._finished(name, job)
+            return finished
+
+    def lookup(self, job_name: str) -> Optional[JobStatus]:
+        with self.lock:
+            self._call('GetTranscriptionJob')
+            job = self.jobs.get(job_name)
+            if job is None:
+                return None
+            if job.done_at > time.time():
+                return JobStatus(job_name, 'IN_PROGRESS')
+            return self._finished(job_name, job)
+
+    def _finished(self, name: str, job: _FakeJob) -> JobStatus:
+        if job.failed:
+            return JobStatus(name, 'FAILED', failure_reason="Simulated failure")
+        return JobStatus(name, 'COMPLETED', transcript={'TranscriptFileUri': f"fake://{name}"})
+
+    def fetch_result(self, transcript: Dict) -> bytes:
+        name = transcript['TranscriptFileUri'].split('://', 1)[1]
+        with self.lock:
+            self._call('GetObject')
+            if name not in self.jobs:
+                raise _client_error('NoSuchKey', 'GetObject')
+        return json.dumps(fake_result(name)).encode('utf-8')
+
+def fake_result(job_name: str, words: Optional[int] = None) -> Dict:
+    """A Transcribe result with `words` words (default Config.FAKE_WORDS_PER_JOB).
+
+    The same job name always gives the same words, speakers and timings.
+    """
+    rng = random.Random(job_name)
+    count = Config.FAKE_WORDS_PER_JOB if words is None else words
+    items = []
+    segments = []
+    text = []
+    clock = 0.0
+    speaker = 0
+    for i in range(count):
+        if i and rng.random() < 0.05:
+            speaker = (speaker + 1) % 2
+            clock += 1.5
+        start, end = clock, clock + rng.uniform(0.15, 0.6)
+        clock = end + rng.uniform(0.0, 0.2)
+        word = rng.choice(_WORDS)
+        label = f"spk_{speaker}"
+        items.append({
+            'start_time': f"{start:.3f}",
+            'end_time': f"{end:.3f}",
+            'alternatives': [{'confidence': f"{rng.uniform(0.6, 1.0):.4f}", 'content': word}],
+            'type': 'pronunciation',
+            'speaker_label': label,
+        })
+        text.append(word)
+        if not segments or segments[-1]['speaker_label'] != label:
+            segments.append({'speaker_label': label, 'start_time': f"{start:.3f}", 'items': []})
+        segments[-1]['items'].append({'speaker_label': label, 'start_time': f"{start:.3f}",
+                                      'end_time': f"{end:.3f}"})
+        segments[-1]['end_time'] = f"{end:.3f}"
+        if rng.random() < 0.1:
+            items.append({'alternatives': [{'confidence': '0.0', 'content': '.'}],
+                          'type': 'punctuation'})
+            text[-1] += '.'
+
+    return {
+        'jobName': job_name,
+        'accountId': '000000000000',
+        'status': 'COMPLETED',
+        'results': {
+            'transcripts': [{'transcript': ' '.join(text)}],
+            'speaker_labels': {'speakers': 2, 'segments': segments},
+            'items': items,
+        },
+    }
+
+_local_s3 = None
+
+def start_local_s3():
+    """Serve S3 from memory with moto for the rest of the process.
+
+    Every boto3 client created afterwards talks to the in-memory S3, and
+    Config.S3_BUCKET is created in it. Needs the optional moto package.
+    """
+    global _local_s3
+    if _local_s3 is not None:
+        return _local_s3
+    try:
+        from moto import mock_aws
+    except ImportError:
+        raise Exception("S3_BACKEND = 'moto' needs the moto package: pip install 'moto[s3]'")
+    from aws_session import get_client
+
+    _local_s3 = mock_aws()
+    _local_s3.start()
+    s3 = get_client('s3')
+    if Config.AWS_REGION == 'us-east-1':
+        s3.create_bucket(Bucket=Config.S3_BUCKET)
+    else:
+        s3.create_bucket(Bucket=Config.S3_BUCKET, CreateBucketConfiguration={
+            'LocationConstraint': Config.AWS_REGION
+        })
+    return _local_s3
@@ -0,0 +1,161 @@
+import asyncio
+import random
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from rich.console import Console
+from backends import JobStatus
+from config import Config
+from telemetry import telemetry
+
+console = Console()
+
+class JobNotFoundError(Exception):
+    """The backend no longer knows a tracked job (expired, or deleted)."""
+
+@dataclass
+class TrackedJob:
+    """A submitted Transcribe job and the future its caller is waiting on."""
+    name: str
+    created: datetime
+    expected_done: float  # loop time we expect the job to finish by
+    deadline: float
+    future: asyncio.Future
+
+class JobPoller:
+    """Tracks every in-flight Transcribe job and refreshes their status in bulk.
+
+    One background task asks the backend for a status batch (for AWS,
+    `list_transcription_jobs` filtered by status and paginated) instead of
+    each caller polling its own job, so the number of API calls per cycle
+    does not grow with the number of jobs in flight. Batches only report
+    finished jobs, so after Config.POLL_VERIFY_CYCLES refreshes that finish
+    nothing, overdue jobs are looked up one by one and those the backend no
+    longer knows fail with JobNotFoundError instead of waiting out
+    Config.JOB_TIMEOUT.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.jobs: Dict[str, TrackedJob] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def track(self, job_name: str, created: Optional[datetime] = None,
+              duration: float = 0) -> asyncio.Future:
+        """Start tracking a submitted job; the returned future resolves with its Transcript."""
+        loop = asyncio.get_running_loop()
+        if job_name in self.jobs:
+            return self.jobs[job_name].future
+
+        now = loop.time()
+        job = TrackedJob(
+            name=job_name,
+            created=created or datetime.now(timezone.utc),
+            expected_done=now + duration * Config.EXPECTED_TRANSCRIBE_RATIO,
+            deadline=now + Config.JOB_TIMEOUT,
+            future=loop.create_future(),
+        )
+        self.jobs[job_name] = job
+
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+        return job.future
+
+    async def _run(self) -> None:
+        """Poll until no tracked jobs remain, backing off while nothing changes."""
+        loop = asyncio.get_running_loop()
+        interval = Config.POLL_MIN_INTERVAL
+        failures = 0
+        idle = 0  # refreshes in a row that finished nothing
+
+        try:
+            while self.jobs:
+                now = loop.time()
+                # Nothing is worth asking about before the soonest job is expected to finish
+                soonest = min(job.expected_done for job in self.jobs.values())
+                delay = min(max(interval, soonest - now), Config.POLL_MAX_INTERVAL)
+                delay *= random.uniform(1 - Config.POLL_JITTER, 1 + Config.POLL_JITTER)
+                await asyncio.sleep(delay)
+
+                try:
+                    resolved = await self._refresh()
+                    idle = 0 if resolved else idle + 1
+                    if idle >= Config.POLL_VERIFY_CYCLES:
+                        idle = 0
+                        resolved += await self._verify()
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    console.print(f"[yellow]Job status refresh failed ({failures}): {str(e)}")
+                    if failures >= Config.MAX_RETRIES:
+                        self._fail_all(Exception(f"Failed to get transcription result: {str(e)}"))
+                        return
+                    resolved = 0
+
+                if resolved:
+                    interval = Config.POLL_MIN_INTERVAL
+                else:
+                    interval = min(interval * Config.POLL_BACKOFF, Config.POLL_MAX_INTERVAL)
+
+                now = loop.time()
+                for name, job in list(self.jobs.items()):
+                    if now > job.deadline:
+                        self._resolve(name, error=Exception("Transcription job timed out"))
+        finally:
+            # Whatever stopped the task, nobody would resolve these futures otherwise
+            if self.jobs:
+                self._fail_all(Exception("Job status poller stopped"))
+
+    async def _refresh(self) -> int:
+        """Fetch finished jobs in bulk and resolve their futures; return how many."""
+        jobs = {name: job.created for name, job in self.jobs.items()}
+        with telemetry.api_call('status_batch'):
+            finished = await asyncio.to_thread(self.backend.status_batch, jobs)
+        for name, job in finished.items():
+            if name in self.jobs:
+                self._finish(job)
+        return len(finished)
+
+    async def _verify(self) -> int:
+        """Look up overdue jobs individually; resolve finished and unknown ones."""
+        now = asyncio.get_running_loop().time()
+        overdue = [name for name, job in self.jobs.items() if job.expected_done < now]
+        resolved = 0
+        for name in overdue:
+            with telemetry.api_call('lookup'):
+                job = await asyncio.to_thread(self.backend.lookup, name)
+            if name not in self.jobs:
+                continue
+            if job is None:
+                telemetry.count('jobs_finished', status='NOT_FOUND')
+                self._resolve(name, error=JobNotFoundError(
+                    f"Transcription job {name} no longer exists"
+                ))
+            elif job.status in ('COMPLETED', 'FAILED'):
+                self._finish(job)
+            else:
+                continue
+            resolved += 1
+        return resolved
+
+    def _finish(self, job: JobStatus) -> None:
+        telemetry.count('jobs_finished', status=job.status)
+        if job.status == 'FAILED':
+            reason = job.failure_reason or 'unknown reason'
+            self._resolve(job.name, error=Exception(f"Transcription job failed: {reason}"))
+        else:
+            self._resolve(job.name, result=job.transcript)
+
+    def _resolve(self, name: str, result: Optional[Dict] = None,
+                 error: Optional[Exception] = None) -> None:
+        job = self.jobs.pop(name)
+        if job.future.done():
+            return
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+
+    def _fail_all(self, error: Exception) -> None:
+        for name in list(self.jobs):
+            self._resolve(name, error=error)
@@ -0,0 +1,298 @@
+import hashlib
+import json
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from config import Config
+
+@dataclass
+class JournalEntry:
+    """What is known to be done for one input file."""
+    input_file: str
+    fingerprint: str
+    duration: int = 0
+    file_uri: Optional[str] = None
+    job_name: Optional[str] = None
+    submitted_at: Optional[datetime] = None
+    output_file: Optional[str] = None
+    kept_intervals: Optional[List] = None  # see vad.SilenceTrimmer
+    digest: Optional[str] = None  # of the conditioned audio, for the result cache
+
+    @property
+    def completed(self) -> bool:
+        return self.output_file is not None and os.path.exists(self.output_file)
+
+def file_fingerprint(input_file: str) -> str:
+    """Cheap identity for a source file, so edited files are not treated as done."""
+    stat = os.stat(input_file)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+def source_identity(input_file: str) -> str:
+    """Identity of a source file's content, to recognise it under another path.
+
+    Size and mtime alone are shared by different recordings written
+    together (e.g. the tracks of a multitrack recorder), so the key also
+    hashes the header, the tail and Config.SOURCE_SAMPLE_BLOCKS blocks
+    spread evenly between them; small files are hashed whole.
+    """
+    stat = os.stat(input_file)
+    block = Config.SOURCE_SAMPLE_SIZE
+    digest = hashlib.sha256()
+    with open(input_file, 'rb') as f:
+        if stat.st_size <= block * (Config.SOURCE_SAMPLE_BLOCKS + 2):
+            digest.update(f.read())
+        else:
+            step = (stat.st_size - block) // (Config.SOURCE_SAMPLE_BLOCKS + 1)
+            for i in range(Config.SOURCE_SAMPLE_BLOCKS + 2):
+                f.seek(min(i * step, stat.st_size - block))
+                digest.update(f.read(block))
+    return f"{stat.st_size}:{stat.st_mtime_ns}:{digest.hexdigest()}"
+
+class JournalBackend(ABC):
+    """Durable per-file record of pipeline progress, used to resume runs."""
+
+    @abstractmethod
+    def get(self, input_file: str) -> Optional[JournalEntry]:
+        """Return the entry for input_file if it matches the file on disk."""
+
+    @abstractmethod
+    def record_upload(self, input_file: str, file_uri: Optional[str], duration: int,
+                      digest: Optional[str] = None,
+                      kept_intervals: Optional[List] = None,
+                      source: Optional[str] = None) -> None:
+        """Record that the conditioned audio is in S3, indexed by its content digest.
+
+        file_uri is None for split recordings, whose chunks are only indexed.
+        kept_intervals is the silence-trimming map, if the audio was trimmed.
+        With source (see source_identity), the upload is also found by
+        find_source_upload for the same content under any path.
+        """
+
+    @abstractmethod
+    def index_upload(self, digest: str, file_uri: str, duration: int) -> None:
+        """Remember that audio with this digest is stored at file_uri."""
+
+    @abstractmethod
+    def find_upload(self, digest: str) -> Optional[Tuple[str, int]]:
+        """Return (file_uri, duration) of audio already uploaded with this digest."""
+
+    @abstractmethod
+    def find_source_upload(self, source: str) -> Optional[Tuple[str, int, Optional[List], str]]:
+        """Return (file_uri, duration, kept_intervals, digest) for a source file seen before under any path.
+
+        source is the file's source_identity.
+
+        Trimming maps belong to the source, not the digest: sources that
+        differ only in how long their silences are trim to the same audio.
+        """
+
+    @abstractmethod
+    def record_submission(self, input_file: str, job_name: str,
+                          submitted_at: datetime) -> None:
+        """Record the name a Transcribe job was submitted under."""
+
+    @abstractmethod
+    def record_chunk_submission(self, input_file: str, index: int, digest: str,
+                                job_name: str, submitted_at: datetime) -> None:
+        """Record the job a split recording's chunk was submitted under."""
+
+    @abstractmethod
+    def find_chunk_jobs(self, input_file: str) -> Dict[int, Tuple[str, str, datetime]]:
+        """Return {chunk index: (digest, job_name, submitted_at)} of the file's submitted chunks."""
+
+    @abstractmethod
+    def record_chunk_failure(self, input_file: str, index: int) -> None:
+        """Forget a chunk's job so the next run resubmits it."""
+
+    @abstractmethod
+    def record_completion(self, input_file: str, output_file: str) -> None:
+        """Record that the transcript has been written."""
+
+    @abstractmethod
+    def record_failure(self, input_file: str) -> None:
+        """Forget the submitted job so the next run resubmits it."""
+
+    def close(self) -> None:
+        pass
+
+class SQLiteJournal(JournalBackend):
+    """Journal kept in a local SQLite database in WAL mode."""
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        # Content index: conditioned-audio digest -> S3 object, and source
+        # identity -> digest so moved or renamed files are recognised
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS uploads (
+                digest TEXT PRIMARY KEY,
+                file_uri TEXT NOT NULL,
+                duration INTEGER NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS source_uploads (
+                source TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                kept_intervals TEXT
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                input_file TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                duration INTEGER NOT NULL DEFAULT 0,
+                file_uri TEXT,
+                job_name TEXT,
+                submitted_at TEXT,
+                output_file TEXT,
+                kept_intervals TEXT,
+                digest TEXT
+            )
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(files)")}
+        if 'digest' not in columns:
+            # Journals from before the result cache
+            self.conn.execute("ALTER TABLE files ADD COLUMN digest TEXT")
+        # Jobs of split recordings' chunks; the digest ties each job to the
+        # audio it was run on, since a re-run splits the file again
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_jobs (
+                input_file TEXT NOT NULL,
+                chunk INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                job_name TEXT NOT NULL,
+                submitted_at TEXT NOT NULL,
+                PRIMARY KEY (input_file, chunk)
+            )
+        """)
+        self.conn.commit()
+
+    def get(self, input_file: str) -> Optional[JournalEntry]:
+        row = self.conn.execute(
+            "SELECT fingerprint, duration, file_uri, job_name, submitted_at, output_file, "
+            "kept_intervals, digest FROM files WHERE input_file = ?",
+            (os.path.abspath(input_file),)
+        ).fetchone()
+        if row is None or row[0] != file_fingerprint(input_file):
+            return None
+        (fingerprint, duration, file_uri, job_name, submitted_at,
+         output_file, kept_intervals, digest) = row
+        return JournalEntry(
+            input_file=input_file,
+            fingerprint=fingerprint,
+            duration=duration,
+            file_uri=file_uri,
+            job_name=job_name,
+            submitted_at=datetime.fromisoformat(submitted_at) if submitted_at else None,
+            output_file=output_file,
+            kept_intervals=json.loads(kept_intervals) if kept_intervals else None,
+            digest=digest,
+        )
+
+    def record_upload(self, input_file: str, file_uri: Optional[str], duration: int,
+                      digest: Optional[str] = None,
+                      kept_intervals: Optional[List] = None,
+                      source: Optional[str] = None) -> None:
+        fingerprint = file_fingerprint(input_file)
+        intervals = json.dumps(kept_intervals) if kept_intervals else None
+        # A new upload starts the file's history over
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files "
+            "(input_file, fingerprint, duration, file_uri, kept_intervals, digest) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (os.path.abspath(input_file), fingerprint, duration, file_uri, intervals, digest)
+        )
+        if digest is not None and file_uri is not None:
+            self._index(digest, file_uri, duration)
+            if source is not None:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO source_uploads (source, digest, kept_intervals) "
+                    "VALUES (?, ?, ?)",
+                    (source, digest, intervals)
+                )
+        self.conn.commit()
+
+    def index_upload(self, digest: str, file_uri: str, duration: int) -> None:
+        self._index(digest, file_uri, duration)
+        self.conn.commit()
+
+    def _index(self, digest: str, file_uri: str, duration: int) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO uploads (digest, file_uri, duration) VALUES (?, ?, ?)",
+            (digest, file_uri, duration)
+        )
+
+    def find_upload(self, digest: str) -> Optional[Tuple[str, int]]:
+        return self.conn.execute(
+            "SELECT file_uri, duration FROM uploads WHERE digest = ?", (digest,)
+        ).fetchone()
+
+    def find_source_upload(self, source: str) -> Optional[Tuple[str, int, Optional[List], str]]:
+        row = self.conn.execute(
+            "SELECT u.file_uri, u.duration, s.kept_intervals, s.digest FROM source_uploads s "
+            "JOIN uploads u ON u.digest = s.digest WHERE s.source = ?",
+            (source,)
+        ).fetchone()
+        if row is None:
+            return None
+        file_uri, duration, intervals, digest = row
+        return file_uri, duration, json.loads(intervals) if intervals else None, digest
+
+    def record_submission(self, input_file: str, job_name: str,
+                          submitted_at: datetime) -> None:
+        self._update(input_file, job_name=job_name, submitted_at=submitted_at.isoformat())
+
+    def record_chunk_submission(self, input_file: str, index: int, digest: str,
+                                job_name: str, submitted_at: datetime) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO chunk_jobs "
+            "(input_file, chunk, digest, job_name, submitted_at) VALUES (?, ?, ?, ?, ?)",
+            (os.path.abspath(input_file), index, digest, job_name, submitted_at.isoformat())
+        )
+        self.conn.commit()
+
+    def find_chunk_jobs(self, input_file: str) -> Dict[int, Tuple[str, str, datetime]]:
+        rows = self.conn.execute(
+            "SELECT chunk, digest, job_name, submitted_at FROM chunk_jobs WHERE input_file = ?",
+            (os.path.abspath(input_file),)
+        ).fetchall()
+        return {index: (digest, job_name, datetime.fromisoformat(submitted_at))
+                for index, digest, job_name, submitted_at in rows}
+
+    def record_chunk_failure(self, input_file: str, index: int) -> None:
+        self.conn.execute(
+            "DELETE FROM chunk_jobs WHERE input_file = ? AND chunk = ?",
+            (os.path.abspath(input_file), index)
+        )
+        self.conn.commit()
+
+    def record_completion(self, input_file: str, output_file: str) -> None:
+        self.conn.execute(
+            "DELETE FROM chunk_jobs WHERE input_file = ?", (os.path.abspath(input_file),)
+        )
+        self._update(input_file, output_file=output_file)
+
+    def record_failure(self, input_file: str) -> None:
+        self._update(input_file, job_name=None, submitted_at=None)
+
+    def _update(self, input_file: str, **fields) -> None:
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        self.conn.execute(
+            f"UPDATE files SET {assignments} WHERE input_file = ?",
+            (*fields.values(), os.path.abspath(input_file))
+        )
+        self.conn.commit()
+
+    def close(self) -> None:
+        self.conn.close()
+
+def open_journal() -> JournalBackend:
+    """Open the journal backend selected by Config.JOURNAL_BACKEND."""
+    if Config.JOURNAL_BACKEND == 'sqlite':
+        return SQLiteJournal(Config.JOURNAL_PATH)
+    raise ValueError(f"Unknown journal backend: {Config.JOURNAL_BACKEND}")
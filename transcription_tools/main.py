@@ -1,24 +1,44 @@
 import asyncio
 import argparse
-from rich.console import Console
-from transcriber import Transcriber
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Audio Transcription Tool')
     parser.add_argument('input_dir', help='Input directory containing WAV files')
-    parser.add_argument('output_dir', help='Output directory for transcripts')
-    return parser.parse_args()
+    parser.add_argument('output_dir', nargs='?', help='Output directory for transcripts')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--enqueue', action='store_true',
+                      help='Put the files into the shared work queue for workers, then exit')
+    mode.add_argument('--worker', action='store_true',
+                      help='Claim files from the shared work queue instead of walking input_dir')
+    parser.add_argument('--queue', help='Work queue location (default: Config.QUEUE_PATH)')
+    args = parser.parse_args()
+    if args.output_dir is None and not args.enqueue:
+        parser.error('output_dir is required unless --enqueue is given')
+    return args
 
 async def main():
-    console = Console()
     args = parse_args()
+    # Imported after parsing, so --help and bad arguments answer at once
+    from rich.console import Console
+    from transcriber import Transcriber
+    from work_queue import open_queue
+    console = Console()
 
+    queue = None
     try:
-        transcriber = Transcriber()
-        await transcriber.process_directory(args.input_dir, args.output_dir)
+        transcriber = Transcriber(pipeline=not args.enqueue)
+        if args.enqueue or args.worker:
+            queue = open_queue(args.queue)
+        if args.enqueue:
+            await transcriber.enqueue_directory(args.input_dir, queue)
+        else:
+            await transcriber.process_directory(args.input_dir, args.output_dir, queue)
     except Exception as e:
         console.print(f"[red]Fatal error: {str(e)}")
         return 1
+    finally:
+        if queue is not None:
+            queue.close()
     return 0
 
 if __name__ == "__main__":
@@ -0,0 +1,141 @@
+import contextlib
+import gzip
+import hashlib
+import json
+import os
+import threading
+import uuid
+from typing import Dict, Optional
+from botocore.exceptions import BotoCoreError, ClientError
+from rich.console import Console
+from backends import job_settings
+from config import Config
+from telemetry import telemetry
+
+console = Console()
+
+def cache_key(digest: str) -> str:
+    """Key of the result for conditioned audio `digest` under the current job settings.
+
+    The digest already covers codec, rate and channels; the backend is
+    part of the key so fake results are never served to a real run.
+    """
+    identity = {'digest': digest, 'backend': Config.TRANSCRIBE_BACKEND, **job_settings()}
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()
+
+class ResultCache:
+    """Transcribe result JSON on local disk, gzipped, one file per key.
+
+    Reads touch the file's mtime, and once the directory grows past
+    `max_bytes` the least recently used entries are deleted until it is
+    back under 90% of it. With an S3 client and prefix, entries are also
+    written to Config.S3_BUCKET and local misses are looked up there, so
+    machines can share results. Methods block; S3 problems and corrupt
+    local entries only cost a miss.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, s3_client=None,
+                 s3_prefix: Optional[str] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.s3_client = s3_client if s3_prefix else None
+        self.s3_prefix = s3_prefix
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        with os.scandir(directory) as entries:
+            self.size = sum(entry.stat().st_size for entry in entries
+                            if entry.name.endswith('.json.gz'))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json.gz")
+
+    def get(self, digest: str) -> Optional[Dict]:
+        """Return the cached result for this audio and the current settings, if any."""
+        key = cache_key(digest)
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            body = self._download(key)
+            if body is None:
+                telemetry.count('cache_misses')
+                return None
+            self._write(key, body)
+        else:
+            # Another process may have evicted it since
+            with contextlib.suppress(FileNotFoundError):
+                os.utime(path)
+        try:
+            result = json.loads(gzip.decompress(body))
+        except (OSError, EOFError, ValueError) as e:
+            # Truncated or corrupt; drop it so the result is fetched and stored again
+            console.print(f"[yellow]Discarding corrupt cached result {key}: {str(e)}")
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            telemetry.count('cache_misses')
+            return None
+        telemetry.count('cache_hits')
+        return result
+
+    def put(self, digest: str, result: Dict) -> None:
+        """Store a job's result (as Transcribe returned it, before any remapping)."""
+        key = cache_key(digest)
+        body = gzip.compress(json.dumps(result, separators=(',', ':')).encode('utf-8'))
+        self._write(key, body)
+        if self.s3_client is not None:
+            try:
+                with telemetry.api_call('put_object'):
+                    self.s3_client.put_object(Bucket=Config.S3_BUCKET,
+                                              Key=f"{self.s3_prefix}{key}.json.gz", Body=body)
+            except (ClientError, BotoCoreError) as e:
+                console.print(f"[yellow]Could not mirror cached result to S3: {str(e)}")
+
+    def _download(self, key: str) -> Optional[bytes]:
+        if self.s3_client is None:
+            return None
+        try:
+            with telemetry.api_call('get_object'):
+                response = self.s3_client.get_object(Bucket=Config.S3_BUCKET,
+                                                     Key=f"{self.s3_prefix}{key}.json.gz")
+                return response['Body'].read()
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey'):
+                console.print(f"[yellow]Could not read cached result from S3: {str(e)}")
+            return None
+        except BotoCoreError as e:
+            console.print(f"[yellow]Could not read cached result from S3: {str(e)}")
+            return None
+
+    def _write(self, key: str, body: bytes) -> None:
+        path = self._path(key)
+        # Unique temp name: other processes may share the directory
+        temp_path = f"{path}.{uuid.uuid4().hex}.part"
+        with open(temp_path, 'wb') as f:
+            f.write(body)
+        os.replace(temp_path, path)
+        with self.lock:
+            self.size += len(body)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Delete least recently used entries; must hold self.lock."""
+        with os.scandir(self.directory) as entries:
+            files = [(entry.stat().st_mtime_ns, entry.stat().st_size, entry.path)
+                     for entry in entries if entry.name.endswith('.json.gz')]
+        # Rescanned rather than tracked, so entries written by other processes count
+        self.size = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if self.size <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+def open_cache(s3_client=None) -> ResultCache:
+    """Open the cache at Config.RESULT_CACHE_DIR, mirrored to S3 if Config.RESULT_CACHE_S3_PREFIX is set."""
+    return ResultCache(Config.RESULT_CACHE_DIR, Config.RESULT_CACHE_MAX_BYTES,
+                       s3_client, Config.RESULT_CACHE_S3_PREFIX)
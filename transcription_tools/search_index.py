@@ -0,0 +1,217 @@
+import argparse
+import os
+import re
+import sqlite3
+import unicodedata
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Tuple
+from config import Config
+from transcript_store import ColumnarTranscript, STORE_EXTENSION, load_store
+
+# A new indexed row starts after this many words, or at a pause or speaker change
+_ROW_WORDS = 40
+_ROW_PAUSE_MS = 1500
+
+_TOKEN = re.compile(r'\w+')
+
+def _tokens(text: str) -> List[str]:
+    """Split text the way FTS5's unicode61 tokenizer with remove_diacritics does."""
+    folded = ''.join(c for c in unicodedata.normalize('NFKD', text.lower())
+                     if not unicodedata.combining(c))
+    return _TOKEN.findall(folded)
+
+@dataclass
+class SearchHit:
+    """One place a query matched: which file, who said it and when (seconds)."""
+    file: str
+    speaker: Optional[str]
+    start: float
+    end: float
+    text: str
+
+class SearchIndex:
+    """Full-text index of word-level transcripts, with timecodes, in SQLite FTS5.
+
+    Each row holds a run of up to _ROW_WORDS words from one speaker with
+    their start/end times alongside, so a hit can be narrowed from the row
+    to the words that matched. Files are re-indexed only when their
+    transcript changes.
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS transcripts (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                mtime REAL NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS segments USING fts5(
+                text,
+                speaker UNINDEXED,
+                transcript_id UNINDEXED,
+                word_starts UNINDEXED,
+                word_ends UNINDEXED,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        """)
+        self.conn.commit()
+
+    def add(self, path: str, transcript: ColumnarTranscript) -> None:
+        """Index (or re-index) the transcript of `path`."""
+        path = os.path.abspath(path)
+        mtime = os.path.getmtime(path) if os.path.exists(path) else 0
+        with self.conn:
+            row = self.conn.execute(
+                "SELECT id FROM transcripts WHERE path = ?", (path,)
+            ).fetchone()
+            if row is None:
+                transcript_id = self.conn.execute(
+                    "INSERT INTO transcripts (path, mtime) VALUES (?, ?)", (path, mtime)
+                ).lastrowid
+            else:
+                transcript_id = row[0]
+                self.conn.execute("DELETE FROM segments WHERE transcript_id = ?", (transcript_id,))
+                self.conn.execute(
+                    "UPDATE transcripts SET mtime = ? WHERE id = ?", (mtime, transcript_id)
+                )
+            self.conn.executemany(
+                "INSERT INTO segments (text, speaker, transcript_id, word_starts, word_ends) "
+                "VALUES (?, ?, ?, ?, ?)",
+                ((text, speaker, transcript_id, starts, ends)
+                 for text, speaker, starts, ends in _rows(transcript))
+            )
+
+    def is_current(self, path: str) -> bool:
+        """True if path is indexed as of its current modification time."""
+        row = self.conn.execute(
+            "SELECT mtime FROM transcripts WHERE path = ?", (os.path.abspath(path),)
+        ).fetchone()
+        return row is not None and row[0] >= os.path.getmtime(path)
+
+    def update_folder(self, folder: str) -> int:
+        """Index every transcript store under folder that is new or changed."""
+        indexed = 0
+        for root, _, files in os.walk(folder):
+            for file in files:
+                if not file.endswith(STORE_EXTENSION):
+                    continue
+                path = os.path.join(root, file)
+                if not self.is_current(path):
+                    self.add(path, load_store(path))
+                    indexed += 1
+        return indexed
+
+    def search(self, query: str, limit: int = 100, phrase: bool = True,
+               ranked: bool = False) -> List[SearchHit]:
+        """Find where query is said, in file and time order.
+
+        By default query is matched as a phrase; pass phrase=False to use
+        FTS5 query syntax (AND/OR/NEAR, prefix*) directly. ranked=True
+        orders by BM25 relevance instead, which has to score every match
+        and so is slower for common words.
+        """
+        match = '"' + query.replace('"', '""') + '"' if phrase else query
+        order = "ORDER BY rank " if ranked else ""
+        rows = self.conn.execute(
+            "SELECT t.path, s.speaker, s.text, s.word_starts, s.word_ends "
+            "FROM segments s JOIN transcripts t ON t.id = s.transcript_id "
+            f"WHERE segments MATCH ? {order}LIMIT ?",
+            (match, limit)
+        ).fetchall()
+
+        hits = []
+        for path, speaker, text, word_starts, word_ends in rows:
+            starts = [int(t) for t in word_starts.split()]
+            ends = [int(t) for t in word_ends.split()]
+            # FTS5 syntax (operators, prefixes) can't be located; report the whole row
+            first, last = _locate(text, _tokens(query)) or (0, len(starts) - 1)
+            hits.append(SearchHit(
+                file=path,
+                speaker=speaker or None,
+                start=starts[first] / 1000,
+                end=ends[last] / 1000,
+                text=text,
+            ))
+        return hits
+
+    def close(self) -> None:
+        self.conn.close()
+
+def _rows(transcript: ColumnarTranscript) -> Iterator[Tuple[str, str, str, str]]:
+    """Group items into (text, speaker, word_starts, word_ends) rows.
+
+    Punctuation is attached to the previous word and gets no time of its
+    own, so there is exactly one start/end per space-separated word.
+    """
+    strings = transcript.strings()
+    words: List[str] = []
+    starts: List[int] = []
+    ends: List[int] = []
+    speaker = -1
+
+    def row():
+        label = transcript.speakers[speaker] if speaker >= 0 else ''
+        return ' '.join(words), label, ' '.join(map(str, starts)), ' '.join(map(str, ends))
+
+    for i in range(len(transcript)):
+        content = strings[transcript.word[i]]
+        if transcript.punctuation[i]:
+            if words:
+                words[-1] += content
+            continue
+        start = int(transcript.start_ms[i])
+        if words and (len(words) >= _ROW_WORDS or transcript.speaker[i] != speaker
+                      or start - ends[-1] > _ROW_PAUSE_MS):
+            yield row()
+            words, starts, ends = [], [], []
+        speaker = int(transcript.speaker[i])
+        words.append(content)
+        starts.append(start)
+        ends.append(int(transcript.end_ms[i]))
+    if words:
+        yield row()
+
+def _locate(text: str, query_tokens: List[str]) -> Optional[Tuple[int, int]]:
+    """Return the (first, last) word indexes in text where query_tokens occur in order."""
+    if not query_tokens:
+        return None
+    tokens = []  # (token, word index) in reading order
+    for index, word in enumerate(text.split(' ')):
+        tokens.extend((token, index) for token in _tokens(word))
+    n = len(query_tokens)
+    for i in range(len(tokens) - n + 1):
+        if all(tokens[i + j][0] == query_tokens[j] for j in range(n)):
+            return tokens[i][1], tokens[i + n - 1][1]
+    return None
+
+def open_index() -> SearchIndex:
+    """Open the index at Config.SEARCH_INDEX_PATH."""
+    return SearchIndex(Config.SEARCH_INDEX_PATH)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search transcripts for where something is said')
+    parser.add_argument('query', nargs='?', help='Words to find (matched as a phrase)')
+    parser.add_argument('--update', metavar='FOLDER',
+                        help='Index new or changed .tstore files under FOLDER first')
+    parser.add_argument('--fts', action='store_true',
+                        help='Treat the query as FTS5 syntax instead of a phrase')
+    parser.add_argument('--ranked', action='store_true',
+                        help='Best matches first instead of file and time order')
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+
+    index = open_index()
+    try:
+        if args.update:
+            print(f"Indexed {index.update_folder(args.update)} transcripts.")
+        if args.query:
+            for hit in index.search(args.query, args.limit, phrase=not args.fts,
+                                    ranked=args.ranked):
+                print(f"{hit.file}\t{hit.speaker or '-'}\t{hit.start:.2f}-{hit.end:.2f}\t{hit.text}")
+    finally:
+        index.close()
@@ -0,0 +1,290 @@
+import bisect
+import hashlib
+import os
+import wave
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from config import Config
+from utils import conditioned_format, decode_pcm, iter_conditioned_frames, open_sink, segment_speakers
+from vad import SilenceTrimmer, to_original_time
+
+@dataclass
+class Chunk:
+    """One piece of a split recording, in seconds of the original file.
+
+    The chunk's audio spans [offset, offset + its length); it owns the
+    transcript words in [own_start, own_end). The difference is the overlap
+    shared with its neighbours, used to match up speaker labels. When the
+    chunk's silences were trimmed, kept_intervals maps its uploaded audio
+    back to the chunk's own timeline (see vad.SilenceTrimmer).
+    """
+    path: str
+    offset: float
+    own_start: float
+    own_end: float
+    duration: int
+    digest: str
+    file_uri: Optional[str] = None
+    job_name: Optional[str] = None
+    submitted_at: Optional[datetime] = None
+    result: Optional[Dict] = None  # from the result cache, when the chunk was seen before
+    kept_intervals: Optional[List] = None
+
+def _frame_energies(input_file: str, hop_seconds: float) -> np.ndarray:
+    """Mean-square energy of the mono mix for each hop, read in fixed-size blocks."""
+    with wave.open(input_file, 'rb') as wav_in:
+        channels = wav_in.getnchannels()
+        width = wav_in.getsampwidth()
+        hop = max(1, int(wav_in.getframerate() * hop_seconds))
+
+        energies = []
+        carry = np.zeros(0, dtype=np.float32)
+        while True:
+            raw = wav_in.readframes(Config.CHUNK_FRAMES)
+            if not raw:
+                break
+            mono = decode_pcm(raw, width, channels).mean(axis=1, dtype=np.float32)
+            samples = np.concatenate([carry, mono])
+            whole = len(samples) // hop * hop
+            if whole:
+                energies.append(np.square(samples[:whole]).reshape(-1, hop).mean(axis=1))
+            carry = samples[whole:]
+        if len(carry):
+            energies.append(np.array([np.square(carry).mean()], dtype=np.float32))
+    return np.concatenate(energies) if energies else np.zeros(0, dtype=np.float32)
+
+def find_split_points(energies: np.ndarray, hop_seconds: float) -> List[float]:
+    """Pick cut times near every Config.SPLIT_CHUNK_LENGTH at the quietest moment.
+
+    The search looks for the lowest smoothed energy within
+    Config.SPLIT_SEARCH_WINDOW seconds either side of each target.
+    """
+    duration = len(energies) * hop_seconds
+    smooth_hops = max(1, int(0.5 / hop_seconds))
+    smoothed = np.convolve(energies, np.ones(smooth_hops) / smooth_hops, mode='same')
+
+    cuts = []
+    last_cut = 0.0
+    while duration - last_cut > Config.SPLIT_CHUNK_LENGTH * 1.5:
+        target = last_cut + Config.SPLIT_CHUNK_LENGTH
+        lo = int((target - Config.SPLIT_SEARCH_WINDOW) / hop_seconds)
+        hi = int((target + Config.SPLIT_SEARCH_WINDOW) / hop_seconds)
+        window = smoothed[lo:hi]
+        quietest = int(np.argmin(window))
+        # Cut in the middle of the quiet stretch, not at its leading edge
+        quiet = window <= window[quietest] * 1.05 + 1e-12
+        start = end = quietest
+        while start > 0 and quiet[start - 1]:
+            start -= 1
+        while end < len(window) - 1 and quiet[end + 1]:
+            end += 1
+        last_cut = (lo + (start + end) / 2 + 0.5) * hop_seconds
+        cuts.append(last_cut)
+    return cuts
+
+def split_wav(input_file: str, output_dir: str, codec: str = 'wav',
+              trim_silence: bool = False) -> Tuple[int, List[Chunk]]:
+    """Condition a long WAV into overlapping chunks cut at low-energy points.
+
+    One pass finds the cut points from frame energies, a second conditions
+    the audio once and routes each block to the (at most two) chunk files
+    it belongs to. With trim_silence each chunk's audio passes through its
+    own vad.SilenceTrimmer on the way. Returns the duration in seconds and
+    the chunks.
+    """
+    hop_seconds = 0.1
+    cuts = find_split_points(_frame_energies(input_file, hop_seconds), hop_seconds)
+
+    with wave.open(input_file, 'rb') as wav_in:
+        duration = wav_in.getnframes() / float(wav_in.getframerate())
+        out_channels, out_rate, out_frames = conditioned_format(
+            wav_in.getnchannels(), wav_in.getframerate(), wav_in.getnframes()
+        )
+        overlap = int(Config.SPLIT_OVERLAP * out_rate)
+        bounds = [0] + [int(cut * out_rate) for cut in cuts] + [out_frames]
+
+        # (start, end) output frames per chunk, including the overlap
+        spans = [(max(0, own_start - overlap), min(out_frames, own_end + overlap))
+                 for own_start, own_end in zip(bounds, bounds[1:])]
+        base_name = os.path.splitext(os.path.basename(input_file))[0]
+        paths = [os.path.join(output_dir, f"{base_name}.part{i:03d}.{codec}")
+                 for i in range(len(spans))]
+        sinks = {}
+        digests = {}
+        trimmers = {}
+
+        position = 0
+        try:
+            for block in iter_conditioned_frames(wav_in):
+                block_end = position + len(block)
+                for i, (start, end) in enumerate(spans):
+                    if end <= position or start >= block_end:
+                        continue
+                    if i not in sinks:
+                        # A trimmed chunk's length is only known at the end; its WAV header gets patched
+                        frames = None if trim_silence else end - start
+                        sinks[i] = open_sink(paths[i], out_channels, out_rate, frames, codec)
+                        digests[i] = hashlib.sha256(f"{codec}:{out_channels}:{out_rate}:".encode())
+                        if trim_silence:
+                            trimmers[i] = SilenceTrimmer(out_rate)
+                    data = block[max(start, position) - position:min(end, block_end) - position]
+                    if trim_silence:
+                        data = trimmers[i].push(data)
+                    _write_chunk(sinks[i], digests[i], data)
+                    if end <= block_end:
+                        if trim_silence:
+                            _write_chunk(sinks[i], digests[i], trimmers[i].flush())
+                        sinks.pop(i).close()
+                position = block_end
+        except BaseException:
+            for sink in sinks.values():
+                sink.abort()
+            raise
+        for i, sink in sinks.items():
+            if trim_silence:
+                _write_chunk(sink, digests[i], trimmers[i].flush())
+            sink.close()
+
+    chunks = [
+        Chunk(
+            path=paths[i],
+            offset=start / out_rate,
+            own_start=own_start / out_rate,
+            own_end=own_end / out_rate,
+            duration=int((trimmers[i].written if trim_silence else end - start) / out_rate),
+            digest=digests[i].hexdigest(),
+            kept_intervals=trimmers[i].kept_intervals if trim_silence else None,
+        )
+        for i, ((start, end), (own_start, own_end))
+        in enumerate(zip(spans, zip(bounds, bounds[1:])))
+    ]
+    return int(duration), chunks
+
+def _write_chunk(sink, digest, block: Optional[np.ndarray]) -> None:
+    if block is not None and len(block):
+        data = block.tobytes()
+        digest.update(data)
+        sink.write(data)
+
+def _speaker_map(previous: List[Tuple[float, str]], current: List[Tuple[float, str]],
+                 next_label: int) -> Tuple[Dict[str, str], int]:
+    """Map a chunk's local speaker labels onto the labels already in use.
+
+    Words both chunks transcribed in their shared overlap vote for a pairing
+    (within half a second of each other); pairs are assigned greedily by
+    vote, and labels with no partner get a fresh global label.
+    """
+    votes = defaultdict(int)
+    times = [t for t, _ in previous]
+    for t, local in current:
+        i = bisect.bisect_left(times, t)
+        nearest = min((j for j in (i - 1, i) if 0 <= j < len(times)),
+                      key=lambda j: abs(times[j] - t), default=None)
+        if nearest is not None and abs(times[nearest] - t) < 0.5:
+            votes[(local, previous[nearest][1])] += 1
+
+    mapping = {}
+    taken = set()
+    for (local, known), _ in sorted(votes.items(), key=lambda kv: -kv[1]):
+        if local not in mapping and known not in taken:
+            mapping[local] = known
+            taken.add(known)
+    for _, local in current:
+        if local not in mapping:
+            mapping[local] = f"spk_{next_label}"
+            next_label += 1
+    return mapping, next_label
+
+def merge_chunk_transcripts(chunks: List[Chunk], results: List[Dict]) -> Dict:
+    """Stitch per-chunk Transcribe results into one result for the whole file.
+
+    Item times are mapped back through any silence trimming and shifted by
+    each chunk's offset, each chunk keeps only the words it owns, and
+    speaker labels are reconciled across chunks through the overlaps.
+    """
+    items = []
+    previous_words: List[Tuple[float, str]] = []
+    next_label = 0
+
+    for chunk, data in zip(chunks, results):
+        results_data = data['results']
+        speakers = segment_speakers(results_data)
+
+        words = []
+        for item in results_data['items']:
+            item = dict(item)
+            if 'start_time' in item:
+                speaker = item.get('speaker_label') or speakers.get(item['start_time'])
+                for key in ('start_time', 'end_time'):
+                    t = float(item[key])
+                    if chunk.kept_intervals:
+                        t = to_original_time(t, chunk.kept_intervals)
+                    item[key] = f"{t + chunk.offset:.3f}"
+                if speaker:
+                    item['speaker_label'] = speaker
+            words.append(item)
+
+        labelled = [(float(w['start_time']), w['speaker_label'])
+                    for w in words if 'speaker_label' in w]
+        overlap = [(t, label) for t, label in labelled if t < chunk.own_start + Config.SPLIT_OVERLAP]
+        mapping, next_label = _speaker_map(previous_words, overlap, next_label)
+        for _, label in labelled:
+            if label not in mapping:
+                mapping[label] = f"spk_{next_label}"
+                next_label += 1
+
+        for item in words:
+            if 'speaker_label' in item:
+                item['speaker_label'] = mapping[item['speaker_label']]
+
+        keeping = False
+        for item in words:
+            if 'start_time' in item:
+                keeping = chunk.own_start <= float(item['start_time']) < chunk.own_end
+            if keeping:
+                items.append(item)
+        previous_words = [(float(item['start_time']), item['speaker_label'])
+                          for item in words if 'speaker_label' in item
+                          and float(item['start_time']) >= chunk.own_end - Config.SPLIT_OVERLAP]
+
+    return {
+        'results': {
+            'transcripts': [{'transcript': _plain_text(items)}],
+            'items': items,
+            'speaker_labels': {
+                'speakers': next_label,
+                'segments': _speaker_segments(items),
+            },
+        },
+    }
+
+def _plain_text(items: List[Dict]) -> str:
+    text = ''
+    for item in items:
+        content = item['alternatives'][0]['content'] if item.get('alternatives') else ''
+        if item.get('type') == 'punctuation' or not text:
+            text += content
+        else:
+            text += ' ' + content
+    return text
+
+def _speaker_segments(items: List[Dict]) -> List[Dict]:
+    """Rebuild speaker_labels.segments as runs of consecutive same-speaker words."""
+    segments = []
+    for item in items:
+        if 'speaker_label' not in item:
+            continue
+        entry = {
+            'start_time': item['start_time'],
+            'end_time': item['end_time'],
+            'speaker_label': item['speaker_label'],
+        }
+        if segments and segments[-1]['speaker_label'] == item['speaker_label']:
+            segments[-1]['end_time'] = item['end_time']
+            segments[-1]['items'].append(entry)
+        else:
+            segments.append(dict(entry, items=[entry]))
+    return segments
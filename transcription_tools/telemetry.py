@@ -0,0 +1,164 @@
+import bisect
+import contextlib
+import cProfile
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+# Upper bounds (seconds) of the span histogram buckets: a HEAD request to an hour-long job
+SPAN_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+class Telemetry:
+    """Timed spans and counters for a run, exported as a trace and as metrics.
+
+    Spans are aggregated into one histogram per name and, when a trace is
+    open, also appended to it as one JSON object per line. Counters are
+    keyed by name and labels. Everything is guarded by one lock, so spans
+    and counters can be recorded from the event loop and from worker
+    threads alike.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.trace = None
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        # span name -> [bucket counts..., overflow, count, sum]
+        self.spans: Dict[str, list] = {}
+
+    def open_trace(self, path: str) -> None:
+        """Append finished spans to path as JSON lines from now on."""
+        with self.lock:
+            if self.trace is not None:
+                self.trace.close()
+            self.trace = open(path, 'a', encoding='utf-8', buffering=1)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.trace is not None:
+                self.trace.close()
+                self.trace = None
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs) -> Iterator[None]:
+        """Time the enclosed block; works around awaits as well as blocking code."""
+        started = time.time()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, started, error, **attrs)
+
+    def record(self, name: str, seconds: float, started: Optional[float] = None,
+               error: Optional[str] = None, **attrs) -> None:
+        """Record a span timed elsewhere."""
+        with self.lock:
+            histogram = self.spans.get(name)
+            if histogram is None:
+                histogram = self.spans[name] = [0] * (len(SPAN_BUCKETS) + 3)
+            histogram[bisect.bisect_left(SPAN_BUCKETS, seconds)] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+            if self.trace is not None:
+                event = {'span': name, 'start': round(started or time.time() - seconds, 6),
+                         'seconds': round(seconds, 6), **attrs}
+                if error is not None:
+                    event['error'] = error
+                self.trace.write(json.dumps(event, default=str) + '\n')
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def api_call(self, operation: str) -> Iterator[None]:
+        """Time one call to an AWS (or stand-in) API and count it, and its throttles."""
+        self.count('api_calls', operation=operation)
+        try:
+            with self.span(f"api.{operation}"):
+                yield
+        except Exception as e:
+            # Imported here: throttle.py records its window waits through this module
+            from throttle import is_throttling
+            if is_throttling(e):
+                self.count('api_throttles', operation=operation)
+            raise
+
+    def prometheus(self) -> str:
+        """Render every counter and span histogram in the Prometheus text format."""
+        with self.lock:
+            counters = dict(self.counters)
+            spans = {name: list(histogram) for name, histogram in self.spans.items()}
+
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            metric = f"transcription_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f"{metric}{_render(labels)} {value:g}")
+
+        if spans:
+            metric = 'transcription_span_seconds'
+            lines.append(f"# HELP {metric} Time spent in each pipeline span")
+            lines.append(f"# TYPE {metric} histogram")
+        for name, histogram in sorted(spans.items()):
+            cumulative = 0
+            for bound, bucket in zip(SPAN_BUCKETS, histogram):
+                cumulative += bucket
+                lines.append(f"{metric}_bucket{_render((('le', f'{bound:g}'), ('span', name)))} "
+                             f"{cumulative}")
+            lines.append(f"{metric}_bucket{_render((('le', '+Inf'), ('span', name)))} "
+                         f"{histogram[-2]}")
+            lines.append(f"{metric}_sum{_render((('span', name),))} {histogram[-1]:.6f}")
+            lines.append(f"{metric}_count{_render((('span', name),))} {histogram[-2]}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str) -> None:
+        """Write the metrics to path atomically, for a node_exporter textfile collector."""
+        with open(path + '.part', 'w', encoding='utf-8') as f:
+            f.write(self.prometheus())
+        os.replace(path + '.part', path)
+
+def _render(labels: Labels) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return '{' + pairs + '}'
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# Shared by the whole process, like the rich consoles
+telemetry = Telemetry()
+
+def run_profiled(profile_dir: Optional[str], stage: str, func: Callable, *args):
+    """Call func(*args), under cProfile when profile_dir is set.
+
+    Meant to be submitted to the CPU stages' process pool: each call is
+    dumped to <profile_dir>/<stage>-<pid>-<time>.prof, which `python -m
+    pstats` or snakeviz can open. The stages are plain module functions
+    in their own worker processes, so `py-spy record --subprocesses`
+    also attributes their time without this hook.
+    """
+    if profile_dir is None:
+        return func(*args)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args)
+    finally:
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(
+            profile_dir, f"{stage}-{os.getpid()}-{time.time_ns()}.prof"
+        ))
@@ -0,0 +1,102 @@
+import asyncio
+import math
+import random
+from typing import Awaitable, Callable, Optional, TypeVar
+from botocore.exceptions import ClientError
+from config import Config
+from telemetry import telemetry
+
+T = TypeVar('T')
+
+# Error codes AWS uses to say "slow down" rather than "this request is wrong"
+THROTTLING_CODES = {
+    'LimitExceededException',       # Transcribe: too many concurrent jobs
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'SlowDown',                     # S3
+    'RequestThrottled',
+    'ProvisionedThroughputExceededException',
+}
+
+class ThrottledError(Exception):
+    """An AWS call was rejected because of a rate or quota limit; retrying later may work."""
+
+def is_throttling(error: Exception) -> bool:
+    """True if error is AWS asking us to back off."""
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in THROTTLING_CODES
+    # s3transfer re-raises part failures as S3UploadFailedError with the code in the text
+    return any(code in str(error) for code in THROTTLING_CODES)
+
+class AdaptiveLimiter:
+    """A concurrency window sized at runtime by additive-increase/multiplicative-decrease.
+
+    `async with limiter:` holds one of `limit` slots. Operations run through
+    `retry` grow the window by one slot per window's worth of successes and
+    halve it (Config.AIMD_DECREASE) on throttling, at most once per
+    Config.AIMD_COOLDOWN seconds so one burst of rejections counts once.
+    Throttled operations are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, name: str, initial: int, maximum: int, minimum: int = 1):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self.on_change: Optional[Callable[[], None]] = None
+        self._condition = asyncio.Condition()
+        self._last_decrease = -math.inf
+
+    @property
+    def window(self) -> int:
+        return int(self.limit)
+
+    async def __aenter__(self) -> 'AdaptiveLimiter':
+        # Time spent here is time the window, not the work, held things up
+        with telemetry.span(f"window.{self.name}"):
+            async with self._condition:
+                await self._condition.wait_for(lambda: self.in_flight < self.window)
+                self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def retry(self, operation: Callable[[], Awaitable[T]]) -> T:
+        """Run operation, backing off and shrinking the window while it is throttled."""
+        attempt = 0
+        while True:
+            try:
+                result = await operation()
+            except ThrottledError:
+                telemetry.count('throttle_retries', window=self.name)
+                attempt += 1
+                if attempt > Config.THROTTLE_RETRIES:
+                    raise
+                await self._set_limit(self._decreased())
+                delay = min(Config.THROTTLE_BACKOFF_MAX,
+                            Config.THROTTLE_BACKOFF_BASE * 2 ** (attempt - 1))
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+                continue
+            await self._set_limit(min(self.maximum, self.limit + 1 / self.limit))
+            return result
+
+    def _decreased(self) -> float:
+        now = asyncio.get_running_loop().time()
+        if now - self._last_decrease < Config.AIMD_COOLDOWN:
+            return self.limit
+        self._last_decrease = now
+        return max(self.minimum, self.limit * Config.AIMD_DECREASE)
+
+    async def _set_limit(self, limit: float) -> None:
+        changed = int(limit) != self.window
+        self.limit = limit
+        if changed:
+            async with self._condition:
+                self._condition.notify_all()
+            if self.on_change is not None:
+                self.on_change()
@@ -1,56 +1,282 @@
 import asyncio
+import itertools
+import math
 import os
-from typing import List
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Optional
 from pathlib import Path
 from rich.console import Console
+from rich.progress import BarColumn, Progress, TaskID, TextColumn, TimeRemainingColumn
 from config import Config
-from audio_processor import AudioProcessor
-from aws_client import AWSTranscribeClient
-from utils import create_parallel_output_dir
+from telemetry import telemetry
+from discovery import AudioInfo, create_parallel_output_dir, iter_wav_files, probe_wav
+from work_queue import WorkLease, WorkQueue
 
 class Transcriber:
-    def __init__(self):
+    def __init__(self, pipeline: bool = True):
+        """With pipeline=False only discovery is set up, which is enough to
+        fill a work queue; AWS clients, the journal and the pipeline modules
+        are then never loaded."""
         self.console = Console()
+        self.processor = None
+        self.journal = None
+        self.index = None
+        if pipeline:
+            self._start_pipeline()
+
+    def _start_pipeline(self) -> None:
+        # Imported here so commands that do not transcribe start quickly
+        from audio_processor import AudioProcessor
+        from aws_client import AWSTranscribeClient
+        from fake_backend import start_local_s3
+        from journal import open_journal
+        from result_cache import open_cache
+        from search_index import open_index
+
+        if Config.S3_BACKEND == 'moto':
+            # Must start before any boto3 client is created
+            start_local_s3()
         self.aws_client = AWSTranscribeClient()
-        self.processor = AudioProcessor(self.aws_client)
-
-    def find_wav_files(self, input_dir: str) -> List[str]:
-        """Find all WAV files in the input directory."""
-        self.console.print(f"[green]Looking for WAV files... in {input_dir}")
-        wav_files = []
-        for root, _, files in os.walk(input_dir):
-            for file in files:
-                if file.lower().endswith('.wav'):
-                    wav_files.append(os.path.join(root, file))
-        return wav_files
-
-    def create_batches(self, files: List[str]) -> List[List[str]]:
-        """Split files into batches."""
-        return [files[i:i + Config.BATCH_SIZE] 
-                for i in range(0, len(files), Config.BATCH_SIZE)]
-
-    async def process_directory(self, input_dir: str, output_dir: str) -> None:
-        """Process all WAV files in the input directory."""
+        self.journal = open_journal()
+        self.index = open_index() if Config.SEARCH_INDEX_PATH else None
+        self.cache = open_cache(self.aws_client.s3_client) if Config.RESULT_CACHE_DIR else None
+        self.processor = AudioProcessor(self.aws_client, self.journal, self.index, self.cache)
+
+    async def discover(self, input_dir: str, progress: Progress,
+                       task_id: TaskID) -> AsyncIterator[AudioInfo]:
+        """Walk input_dir in the background and yield usable files as they are found.
+
+        Paths stream from a scandir walk through header probes into a
+        priority queue of at most Config.SCHEDULE_WINDOW files, so memory
+        stays flat however large the tree is and the first file is yielded
+        as soon as it has been probed. While the pipeline is busy the window
+        fills up and the longest recording in it is handed out first.
+        Unreadable or truncated files are reported and skipped, and the
+        progress total grows by each file's audio seconds as it is found.
+        """
+        loop = asyncio.get_running_loop()
+        paths = asyncio.Queue(maxsize=Config.PREFLIGHT_WORKERS * 4)
+        schedule = asyncio.PriorityQueue(maxsize=Config.SCHEDULE_WINDOW)
+        order = itertools.count()  # tie-breaker, so AudioInfo is never compared
+        found = {'files': 0, 'seconds': 0.0}
+
+        def walk():
+            for path in iter_wav_files(input_dir):
+                asyncio.run_coroutine_threadsafe(paths.put(path), loop).result()
+
+        async def probe(pool: ThreadPoolExecutor):
+            while True:
+                path = await paths.get()
+                if path is None:
+                    return
+                try:
+                    info = await loop.run_in_executor(pool, probe_wav, path)
+                except (OSError, ValueError) as e:
+                    progress.console.print(f"[yellow]Skipping {path}: {str(e)}")
+                    continue
+                found['files'] += 1
+                found['seconds'] += info.duration
+                progress.update(task_id, total=found['seconds'])
+                await schedule.put((-info.duration, next(order), info))
+
+        async def produce():
+            try:
+                with ThreadPoolExecutor(max_workers=Config.PREFLIGHT_WORKERS) as pool:
+                    probes = [asyncio.create_task(probe(pool))
+                              for _ in range(Config.PREFLIGHT_WORKERS)]
+                    try:
+                        await loop.run_in_executor(None, walk)
+                    finally:
+                        for _ in probes:
+                            await paths.put(None)
+                        await asyncio.gather(*probes)
+            finally:
+                # Sorts after every file still waiting in the window; queued
+                # even if the walk failed, so the loop below ends and
+                # awaiting the producer raises its error
+                await schedule.put((math.inf, next(order), None))
+
+        producer = asyncio.create_task(produce())
         try:
-            # Find all WAV files
-            wav_files = self.find_wav_files(input_dir)
-            if not wav_files:
-                self.console.print("[yellow]No WAV files found in the input directory.")
+            while True:
+                _, _, info = await schedule.get()
+                if info is None:
+                    break
+                yield info
+            await producer
+        finally:
+            producer.cancel()
+
+        if found['files']:
+            progress.console.print(
+                f"[green]Found {found['files']} WAV files "
+                f"({found['seconds'] / 3600:.1f} hours of audio)."
+            )
+        else:
+            progress.console.print("[yellow]No WAV files found in the input directory.")
+
+    async def claim(self, queue: WorkQueue, input_dir: str, progress: Progress,
+                    task_id: TaskID) -> AsyncIterator[AudioInfo]:
+        """Yield files leased from the shared queue until it is sealed and drained.
+
+        Queued paths are relative, so input_dir is wherever this node mounts
+        the archive. Held leases are renewed every
+        Config.QUEUE_HEARTBEAT_INTERVAL and settled as the pipeline finishes
+        each file: done, or back to the queue for another attempt.
+        """
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        leases: Dict[str, WorkLease] = {}
+        total = 0.0
+
+        async def finished(input_file: str, error: Optional[Exception]) -> None:
+            lease = leases.pop(input_file, None)
+            if lease is None:
                 return
+            if error is None:
+                await asyncio.to_thread(queue.complete, lease)
+            else:
+                await asyncio.to_thread(queue.fail, lease, str(error))
 
-            self.console.print(f"[green]Found {len(wav_files)} WAV files to process.")
+        async def heartbeat():
+            while True:
+                await asyncio.sleep(Config.QUEUE_HEARTBEAT_INTERVAL)
+                lost = await asyncio.to_thread(
+                    queue.heartbeat, list(leases.values()), Config.QUEUE_LEASE_SECONDS
+                )
+                for lease in lost:
+                    progress.console.print(
+                        f"[yellow]Lost the lease on {lease.path}; another worker may redo it"
+                    )
+                    leases.pop(os.path.join(input_dir, lease.path), None)
+
+        self.processor.on_finished = finished
+        beating = asyncio.create_task(heartbeat())
+        try:
+            while True:
+                lease = await asyncio.to_thread(queue.claim, worker, Config.QUEUE_LEASE_SECONDS)
+                if lease is None:
+                    # Leases held elsewhere may still expire and come back
+                    counts = await asyncio.to_thread(queue.counts)
+                    if (not counts.get('pending') and not counts.get('leased')
+                            and await asyncio.to_thread(queue.is_sealed)):
+                        break
+                    await asyncio.sleep(Config.QUEUE_POLL_INTERVAL)
+                    continue
+
+                path = os.path.join(input_dir, lease.path)
+                try:
+                    info = await asyncio.to_thread(probe_wav, path)
+                except (OSError, ValueError) as e:
+                    progress.console.print(f"[yellow]Skipping {path}: {str(e)}")
+                    await asyncio.to_thread(queue.fail, lease, str(e))
+                    continue
+                leases[path] = lease
+                total += info.duration
+                progress.update(task_id, total=total)
+                yield info
+        finally:
+            beating.cancel()
+            self.processor.on_finished = None
+
+    async def enqueue_directory(self, input_dir: str, queue: WorkQueue) -> None:
+        """Coordinator: put every usable WAV under input_dir into the shared queue.
+
+        The queue is sealed once the walk is done, which tells workers they
+        can exit when it has drained.
+        """
+        try:
+            await asyncio.to_thread(queue.set_sealed, False)
+            added = 0
+            batch = []
+            with Progress(
+                TextColumn("[progress.description]{task.description}"),
+                TextColumn("{task.total:,.0f} audio s found"),
+                console=self.console,
+            ) as progress:
+                task = progress.add_task("[cyan]Queueing audio files...", total=0)
+                async for info in self.discover(input_dir, progress, task):
+                    batch.append((os.path.relpath(info.path, input_dir), info.duration))
+                    if len(batch) >= 500:
+                        added += await asyncio.to_thread(queue.put, batch)
+                        batch = []
+                if batch:
+                    added += await asyncio.to_thread(queue.put, batch)
+            await asyncio.to_thread(queue.set_sealed, True)
+
+            counts = await asyncio.to_thread(queue.counts)
+            self.console.print(
+                f"[green]Queued {added} new files. Queue: "
+                + ', '.join(f"{counts.get(status, 0)} {status}"
+                            for status in ('pending', 'leased', 'done', 'failed'))
+            )
+        finally:
+            self.close()
+
+    async def export_metrics(self) -> None:
+        """Rewrite Config.METRICS_PATH every Config.METRICS_INTERVAL seconds."""
+        while True:
+            await asyncio.sleep(Config.METRICS_INTERVAL)
+            telemetry.write_prometheus(Config.METRICS_PATH)
+
+    async def process_directory(self, input_dir: str, output_dir: str,
+                                queue: Optional[WorkQueue] = None) -> None:
+        """Process all WAV files in the input directory.
+
+        With a queue (worker mode), files are claimed from it instead of
+        walked, so several machines can share one archive.
+
+        Spans and counters (telemetry.py) go to Config.TRACE_PATH and
+        Config.METRICS_PATH when those are set.
+        """
+        if Config.TRACE_PATH:
+            telemetry.open_trace(Config.TRACE_PATH)
+        exporter = None
+        if Config.METRICS_PATH:
+            exporter = asyncio.create_task(self.export_metrics())
+        try:
+            if queue is None:
+                self.console.print(f"[green]Looking for WAV files... in {input_dir}")
+            else:
+                self.console.print(f"[green]Claiming WAV files under {input_dir} from the work queue")
 
             # Create output directory structure
             output_dir = create_parallel_output_dir(input_dir, output_dir)
 
-            # Process files in batches
-            batches = self.create_batches(wav_files)
-            for i, batch in enumerate(batches, 1):
-                self.console.print(f"[cyan]Processing batch {i}/{len(batches)}...")
-                await self.processor.process_batch(batch, output_dir)
+            # One continuous run that starts on the first file found, with a
+            # single progress bar measured in audio seconds so the ETA
+            # reflects the work left
+            with Progress(
+                TextColumn("[progress.description]{task.description}"),
+                BarColumn(),
+                TextColumn("{task.completed:,.0f}/{task.total:,.0f} audio s"),
+                TimeRemainingColumn(),
+                TextColumn("[dim]{task.fields[limits]}"),
+                console=self.console,
+            ) as progress:
+                task = progress.add_task("[cyan]Processing audio files...", total=0, limits="")
+                if queue is None:
+                    files = self.discover(input_dir, progress, task)
+                else:
+                    files = self.claim(queue, input_dir, progress, task)
+                await self.processor.process_files(files, input_dir, output_dir, progress, task)
 
             self.console.print("[green]Transcription completed successfully!")
 
         except Exception as e:
             self.console.print(f"[red]Error during transcription: {str(e)}")
             raise
+        finally:
+            if exporter is not None:
+                exporter.cancel()
+                telemetry.write_prometheus(Config.METRICS_PATH)
+            telemetry.close()
+            self.close()
+
+    def close(self) -> None:
+        if self.processor is not None:
+            self.processor.close()
+        if self.journal is not None:
+            self.journal.close()
+        if self.index is not None:
+            self.index.close()
@@ -0,0 +1,217 @@
+import argparse
+import json
+import os
+import struct
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+from utils import segment_speakers
+
+MAGIC = b'TSTORE1\n'
+STORE_EXTENSION = '.tstore'
+_ALIGN = 64
+
+# Column name -> dtype, in file order
+_COLUMNS = {
+    'start_ms': '<i4',      # -1 for punctuation, which Transcribe gives no time
+    'end_ms': '<i4',
+    'confidence': '<f4',
+    'speaker': '<i2',       # index into speakers, -1 when unlabelled
+    'word': '<i4',          # index into the string table
+    'punctuation': 'u1',    # 1 if the item is punctuation
+    'string_offsets': '<i8',
+    'string_data': 'u1',    # UTF-8 words, back to back
+}
+
+@dataclass
+class ColumnarTranscript:
+    """A transcript as parallel per-item arrays plus interned strings.
+
+    Item i is `strings[word[i]]`, spoken by `speakers[speaker[i]]` from
+    start_ms[i] to end_ms[i]. Loaded with `load_store`, every array is a
+    read-only memory map, so opening a file costs almost nothing and pages
+    are read only when touched.
+    """
+    start_ms: np.ndarray
+    end_ms: np.ndarray
+    confidence: np.ndarray
+    speaker: np.ndarray
+    word: np.ndarray
+    punctuation: np.ndarray
+    string_offsets: np.ndarray
+    string_data: np.ndarray
+    speakers: List[str]
+
+    def __len__(self) -> int:
+        return len(self.word)
+
+    @property
+    def start(self) -> np.ndarray:
+        """Start times in seconds."""
+        return self.start_ms / 1000.0
+
+    @property
+    def end(self) -> np.ndarray:
+        """End times in seconds."""
+        return self.end_ms / 1000.0
+
+    def string(self, index: int) -> str:
+        """Decode one entry of the string table."""
+        begin, end = self.string_offsets[index], self.string_offsets[index + 1]
+        return self.string_data[begin:end].tobytes().decode('utf-8')
+
+    def strings(self) -> List[str]:
+        """Decode the whole string table."""
+        data = self.string_data.tobytes()
+        offsets = self.string_offsets.tolist()
+        return [data[a:b].decode('utf-8') for a, b in zip(offsets, offsets[1:])]
+
+    def word_id(self, text: str) -> Optional[int]:
+        """Index of text in the string table, or None if no item uses it."""
+        try:
+            return self.strings().index(text)
+        except ValueError:
+            return None
+
+    def items(self) -> Iterator[Dict]:
+        """Yield items shaped like Transcribe's `results.items`."""
+        strings = self.strings()
+        for i in range(len(self)):
+            item = {
+                'type': 'punctuation' if self.punctuation[i] else 'pronunciation',
+                'alternatives': [{
+                    'content': strings[self.word[i]],
+                    'confidence': f"{float(self.confidence[i]):.4f}",
+                }],
+            }
+            if not self.punctuation[i]:
+                item['start_time'] = f"{self.start_ms[i] / 1000:.3f}"
+                item['end_time'] = f"{self.end_ms[i] / 1000:.3f}"
+            if self.speaker[i] >= 0:
+                item['speaker_label'] = self.speakers[self.speaker[i]]
+            yield item
+
+def from_transcribe_json(transcript_data: Dict) -> ColumnarTranscript:
+    """Convert a Transcribe result (as fetched or downloaded) in one pass over its items."""
+    results = transcript_data['results']
+    speakers_by_time = segment_speakers(results)
+    items = results.get('items', [])
+    n = len(items)
+
+    start_ms = np.full(n, -1, dtype=_COLUMNS['start_ms'])
+    end_ms = np.full(n, -1, dtype=_COLUMNS['end_ms'])
+    confidence = np.zeros(n, dtype=_COLUMNS['confidence'])
+    speaker = np.full(n, -1, dtype=_COLUMNS['speaker'])
+    word = np.zeros(n, dtype=_COLUMNS['word'])
+    punctuation = np.zeros(n, dtype=_COLUMNS['punctuation'])
+
+    strings: Dict[str, int] = {}
+    speaker_ids: Dict[str, int] = {}
+    for i, item in enumerate(items):
+        alternative = item['alternatives'][0] if item.get('alternatives') else {}
+        content = alternative.get('content', '')
+        word[i] = strings.setdefault(content, len(strings))
+        confidence[i] = float(alternative.get('confidence') or 0)
+        if item.get('type') == 'punctuation':
+            punctuation[i] = 1
+        if 'start_time' in item:
+            start_ms[i] = round(float(item['start_time']) * 1000)
+            end_ms[i] = round(float(item['end_time']) * 1000)
+        label = item.get('speaker_label') or speakers_by_time.get(item.get('start_time'))
+        if label:
+            speaker[i] = speaker_ids.setdefault(label, len(speaker_ids))
+
+    encoded = [s.encode('utf-8') for s in strings]
+    string_offsets = np.zeros(len(encoded) + 1, dtype=_COLUMNS['string_offsets'])
+    np.cumsum([len(b) for b in encoded], out=string_offsets[1:])
+    string_data = np.frombuffer(b''.join(encoded), dtype=_COLUMNS['string_data'])
+
+    return ColumnarTranscript(
+        start_ms=start_ms, end_ms=end_ms, confidence=confidence, speaker=speaker,
+        word=word, punctuation=punctuation, string_offsets=string_offsets,
+        string_data=string_data, speakers=list(speaker_ids),
+    )
+
+def save_store(path: str, transcript: ColumnarTranscript) -> str:
+    """Write transcript to path (written to a temp file, then renamed into place).
+
+    Layout: MAGIC, a little-endian u32 header length, a JSON header with the
+    speakers and each column's offset and length, then the columns, each
+    aligned to 64 bytes so it can be memory-mapped directly.
+    """
+    columns = {name: np.ascontiguousarray(getattr(transcript, name), dtype=dtype)
+               for name, dtype in _COLUMNS.items()}
+    layout = {}
+    header = b''
+    # The header's size moves the data offsets; settle both in two passes
+    for _ in range(2):
+        offset = len(MAGIC) + 4 + len(header)
+        for name, array in columns.items():
+            offset = -(-offset // _ALIGN) * _ALIGN
+            layout[name] = {'offset': offset, 'length': len(array)}
+            offset += array.nbytes
+        header = json.dumps({'speakers': transcript.speakers, 'columns': layout}).encode()
+        header += b' ' * (-(len(MAGIC) + 4 + len(header)) % _ALIGN)
+
+    temp_path = path + '.part'
+    with open(temp_path, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for name, array in columns.items():
+            f.write(b'\0' * (layout[name]['offset'] - f.tell()))
+            f.write(array.tobytes())
+    os.replace(temp_path, path)
+    return path
+
+def load_store(path: str) -> ColumnarTranscript:
+    """Open a store file; its columns are memory-mapped, not read."""
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a transcript store: {path}")
+        (header_length,) = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_length))
+
+    columns = {}
+    for name, dtype in _COLUMNS.items():
+        spec = header['columns'][name]
+        if spec['length'] == 0:
+            columns[name] = np.zeros(0, dtype=dtype)
+        else:
+            columns[name] = np.memmap(path, dtype=dtype, mode='r',
+                                      offset=spec['offset'], shape=(spec['length'],))
+    return ColumnarTranscript(speakers=header['speakers'], **columns)
+
+def store_path(transcript_path: str) -> str:
+    """Where the store for a transcript file (.json or .txt) lives."""
+    return os.path.splitext(transcript_path)[0] + STORE_EXTENSION
+
+def convert_json_file(json_path: str, output_path: Optional[str] = None) -> str:
+    """Convert one Transcribe JSON file into a store next to it (or at output_path)."""
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return save_store(output_path or store_path(json_path), from_transcribe_json(data))
+
+def convert_folder(json_folder: str, output_folder: str) -> int:
+    """Convert every JSON result in json_folder whose store is missing or older."""
+    os.makedirs(output_folder, exist_ok=True)
+    converted = 0
+    with os.scandir(json_folder) as entries:
+        for entry in entries:
+            if not entry.name.endswith('.json') or entry.name.startswith('.'):
+                continue
+            output_path = store_path(os.path.join(output_folder, entry.name))
+            if (os.path.exists(output_path)
+                    and os.path.getmtime(output_path) >= entry.stat().st_mtime):
+                continue
+            try:
+                convert_json_file(entry.path, output_path)
+                converted += 1
+            except (ValueError, KeyError) as e:
+                print(f"Failed to convert {entry.name}: {str(e)}")
+    return converted
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert Transcribe JSON results to transcript stores')
+    parser.add_argument('json_folder', nargs='?', default='transcripts')
+    parser.add_argument('output_folder', nargs='?', default='transcripts')
+    args = parser.parse_args()
+    print(f"Converted {convert_folder(args.json_folder, args.output_folder)} files.")
@@ -1,101 +1,286 @@
+import hashlib
 import os
+import subprocess
 import wave
-import audioop
 from pathlib import Path
-from typing import Tuple
-from rich.console import Console
-from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
 from config import Config
+from vad import SilenceTrimmer
 
-console = Console()
+def conditioned_format(channels: int, rate: int, nframes: int) -> Tuple[int, int, int]:
+    """Return the (channels, rate, frames) a WAV will have after conditioning."""
+    out_channels = min(channels, Config.TARGET_CHANNELS)
+    out_rate = min(rate, Config.TARGET_SAMPLE_RATE)
+    # Output frame k sits at source position k * rate / out_rate
+    out_frames = (nframes * out_rate + rate - 1) // rate
+    return out_channels, out_rate, out_frames
 
-def create_parallel_output_dir(input_path: str, base_output_dir: str) -> str:
-    """Create parallel output directory structure."""
-    rel_path = os.path.relpath(input_path, base_output_dir)
-    output_path = os.path.join(base_output_dir, "transcripts", rel_path)
-    os.makedirs(output_path, exist_ok=True)
-    return output_path
+def decode_pcm(raw: bytes, width: int, channels: int) -> np.ndarray:
+    """Decode interleaved little-endian PCM into a (frames, channels) float32 array."""
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype='<i2').astype(np.float32) / 32768.0
+    elif width == 3:
+        packed = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        ints = packed[:, 0] | (packed[:, 1] << 8) | (packed[:, 2] << 16)
+        ints = (ints << 8) >> 8  # sign-extend 24-bit samples
+        samples = ints.astype(np.float32) / 8388608.0
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype='<i4').astype(np.float32) / 2147483648.0
+    else:
+        raise ValueError(f"Unsupported sample width: {width} bytes")
+    return samples.reshape(-1, channels)
 
-def compress_wav(input_file: str, output_file: str) -> Tuple[str, int]:
-    """Compress WAV file and return the path and duration."""
+class _StreamingResampler:
+    """Linear-interpolation resampler that carries its state across blocks.
+
+    Downsampling runs a boxcar pre-filter one output period wide first, so
+    content above the new Nyquist is attenuated rather than folded back.
+    """
+
+    def __init__(self, src_rate: int, dst_rate: int, channels: int):
+        self.src_rate = src_rate
+        self.dst_rate = dst_rate
+        self.taps = max(1, round(src_rate / dst_rate))
+        self.history = np.zeros((self.taps - 1, channels), dtype=np.float32)
+        self.tail = np.zeros((0, channels), dtype=np.float32)
+        self.tail_index = 0  # source index of self.tail[0]
+        self.emitted = 0     # output frames produced so far
+
+    def _filter(self, block: np.ndarray) -> np.ndarray:
+        if self.taps == 1:
+            return block
+        padded = np.concatenate([self.history, block])
+        self.history = padded[len(padded) - (self.taps - 1):]
+        csum = np.cumsum(padded, axis=0, dtype=np.float64)
+        csum = np.concatenate([np.zeros((1, padded.shape[1])), csum])
+        return ((csum[self.taps:] - csum[:-self.taps]) / self.taps).astype(np.float32)
+
+    def _emit(self, buf: np.ndarray, stop: int) -> np.ndarray:
+        k = np.arange(self.emitted, stop, dtype=np.float64)
+        # Shift by the boxcar's group delay so timestamps stay aligned
+        positions = k * self.src_rate / self.dst_rate + (self.taps - 1) / 2 - self.tail_index
+        grid = np.arange(len(buf))
+        out = np.empty((len(k), buf.shape[1]), dtype=np.float32)
+        for ch in range(buf.shape[1]):
+            out[:, ch] = np.interp(positions, grid, buf[:, ch])
+        self.emitted = stop
+        return out
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """Resample one block, holding back what needs the next block."""
+        if self.src_rate == self.dst_rate:
+            self.emitted += len(block)
+            return block
+        buf = np.concatenate([self.tail, self._filter(block)])
+        if len(buf) == 0:
+            return buf
+        last_index = self.tail_index + len(buf) - 1
+        ready = (2 * last_index - (self.taps - 1)) * self.dst_rate // (2 * self.src_rate) + 1
+        out = self._emit(buf, max(ready, self.emitted))
+        self.tail = buf[-1:]
+        self.tail_index = last_index
+        return out
+
+    def flush(self, total_frames: int) -> np.ndarray:
+        """Emit the remaining frames up to total_frames, holding the last sample."""
+        if self.emitted >= total_frames or len(self.tail) == 0:
+            return np.zeros((0, self.tail.shape[1]), dtype=np.float32)
+        return self._emit(self.tail, total_frames)
+
+def iter_conditioned_frames(wav_in: wave.Wave_read) -> Iterator[np.ndarray]:
+    """Yield int16 (frames, channels) blocks of mono-downmixed, resampled audio.
+
+    Reads Config.CHUNK_FRAMES frames at a time, so memory stays constant
+    regardless of the file's length.
+    """
+    channels = wav_in.getnchannels()
+    width = wav_in.getsampwidth()
+    rate = wav_in.getframerate()
+    out_channels, out_rate, out_frames = conditioned_format(
+        channels, rate, wav_in.getnframes()
+    )
+    resampler = _StreamingResampler(rate, out_rate, out_channels)
+
+    def to_int16(block: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(block * 32768.0), -32768, 32767).astype('<i2')
+
+    while True:
+        raw = wav_in.readframes(Config.CHUNK_FRAMES)
+        if not raw:
+            break
+        block = decode_pcm(raw, width, channels)
+        if out_channels < channels:
+            block = block.mean(axis=1, keepdims=True, dtype=np.float32)
+        block = resampler.process(block)
+        if len(block):
+            yield to_int16(block)
+
+    block = resampler.flush(out_frames)
+    if len(block):
+        yield to_int16(block)
+
+# Upload codecs: file extension / Transcribe MediaFormat, and ffmpeg arguments
+CODECS = {
+    'wav': None,
+    'flac': ['-c:a', 'flac', '-compression_level', '5', '-f', 'flac'],
+    'ogg': ['-c:a', 'libopus', '-application', 'voip', '-f', 'ogg'],
+}
+
+class _WavSink:
+    """Writes 16-bit PCM blocks into a WAV container without seeking."""
+
+    def __init__(self, output_file: str, channels: int, rate: int, frames: Optional[int]):
+        self.wav_out = wave.open(output_file, 'wb')
+        self.wav_out.setnchannels(channels)
+        self.wav_out.setsampwidth(2)
+        self.wav_out.setframerate(rate)
+        # Exact up front, so the header never needs patching and
+        # output_file may be a pipe; None means output_file must be seekable
+        if frames is not None:
+            self.wav_out.setnframes(frames)
+
+    def write(self, data: bytes) -> None:
+        self.wav_out.writeframesraw(data)
+
+    def close(self) -> None:
+        self.wav_out.close()
+
+    def abort(self) -> None:
+        self.wav_out.close()
+
+class _FFmpegSink:
+    """Pipes 16-bit PCM blocks through an ffmpeg encoder into output_file."""
+
+    def __init__(self, output_file: str, channels: int, rate: int, codec: str):
+        args = [
+            'ffmpeg', '-nostdin', '-loglevel', 'error', '-y',
+            '-f', 's16le', '-ar', str(rate), '-ac', str(channels), '-i', 'pipe:0',
+            *CODECS[codec],
+        ]
+        if codec == 'ogg':
+            args += ['-b:a', Config.OPUS_BITRATE]
+        try:
+            self.proc = subprocess.Popen(
+                args + [output_file],
+                stdin=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+        except FileNotFoundError:
+            raise RuntimeError(f"ffmpeg is required for the '{codec}' upload codec")
+
+    def write(self, data: bytes) -> None:
+        self.proc.stdin.write(data)
+
+    def close(self) -> None:
+        self.proc.stdin.close()
+        stderr = self.proc.stderr.read()
+        if self.proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()}")
+
+    def abort(self) -> None:
+        self.proc.kill()
+        self.proc.wait()
+
+def open_sink(output_file: str, channels: int, rate: int, frames: Optional[int], codec: str):
+    """Open a writer for 16-bit PCM blocks encoded as `codec`."""
+    if codec not in CODECS:
+        raise ValueError(f"Unsupported upload codec: {codec}")
+    if codec == 'wav':
+        return _WavSink(output_file, channels, rate, frames)
+    return _FFmpegSink(output_file, channels, rate, codec)
+
+def compress_wav(input_file: str, output_file: str, codec: str = 'wav',
+                 trim_silence: bool = False) -> Tuple[str, int, str, Optional[List]]:
+    """Downmix and resample a WAV file in fixed-size blocks, encoding it as `codec`.
+
+    Returns the output path, the duration in seconds, a SHA-256 content
+    digest of the conditioned audio (hashed as the blocks are written) and,
+    with trim_silence, the kept-interval map from vad.SilenceTrimmer
+    (otherwise None). Codecs other than 'wav' are encoded by an ffmpeg
+    child process.
+    """
     with wave.open(input_file, 'rb') as wav_in:
-        # Get original parameters
         channels = wav_in.getnchannels()
-        width = wav_in.getsampwidth()
         rate = wav_in.getframerate()
-        frames = wav_in.readframes(wav_in.getnframes())
         duration = wav_in.getnframes() / float(rate)
+        out_channels, out_rate, out_frames = conditioned_format(
+            channels, rate, wav_in.getnframes()
+        )
 
-        # # Convert to mono if needed
-        # if channels > 1:
-        #     frames = audioop.tomono(frames, width, 1, 1)
-        #     channels = 1
+        # The format is part of the identity: equal samples at another rate
+        # or in another container are a different object
+        digest = hashlib.sha256(f"{codec}:{out_channels}:{out_rate}:".encode())
+        blocks = iter_conditioned_frames(wav_in)
+        trimmer = None
+        if trim_silence:
+            trimmer = SilenceTrimmer(out_rate)
+            blocks = trimmer.trim(blocks)
+            # The trimmed length is unknown until the end; let the WAV header be patched
+            out_frames = None
 
-        # # Downsample if needed
-        # if rate > Config.TARGET_SAMPLE_RATE:
-        #     frames = audioop.ratecv(frames, width, 1, rate,
-        #                           Config.TARGET_SAMPLE_RATE, None)[0]
-        #     rate = Config.TARGET_SAMPLE_RATE
+        sink = open_sink(output_file, out_channels, out_rate, out_frames, codec)
+        try:
+            for block in blocks:
+                data = block.tobytes()
+                digest.update(data)
+                sink.write(data)
+        except BaseException:
+            sink.abort()
+            raise
+        sink.close()
 
-    # Write compressed file
-    with wave.open(output_file, 'wb') as wav_out:
-        wav_out.setnchannels(channels)
-        wav_out.setsampwidth(width)
-        wav_out.setframerate(rate)
-        wav_out.writeframes(frames)
+    kept_intervals = trimmer.kept_intervals if trimmer is not None else None
+    return output_file, int(duration), digest.hexdigest(), kept_intervals
 
-    return output_file, int(duration)
-
-def get_output_filename(input_file: str, output_dir: str) -> str:
-    """Generate output filename for transcript."""
+def get_output_filename(input_file: str, output_dir: str, extension: str = '.txt') -> str:
+    """Generate output filename for transcript; the same input always maps to the same name."""
     base_name = os.path.splitext(os.path.basename(input_file))[0]
-    timestamp = datetime.now().strftime(Config.TIMESTAMP_FORMAT)
-    return os.path.join(output_dir, f"{base_name}_{timestamp}.txt")
+    return os.path.join(output_dir, f"{base_name}{extension}")
+
+def segment_speakers(results: dict) -> Dict[str, str]:
+    """Map item start_time to speaker label from `speaker_labels.segments`."""
+    speakers = {}
+    for segment in results.get('speaker_labels', {}).get('segments', []):
+        for segment_item in segment.get('items', []):
+            speakers[segment_item['start_time']] = segment_item['speaker_label']
+    return speakers
+
+def format_transcript(transcript_data: dict) -> str:
+    """Format a Transcribe result as one line per speaker turn.
+
+    Walks `results.items` once; each word's speaker comes from its own
+    `speaker_label` or, failing that, from `speaker_labels.segments`.
+    Punctuation is attached to the preceding word.
+    """
+    results = transcript_data['results']
+    speakers = segment_speakers(results)
 
-def format_transcript(transcript: dict) -> str:
-    """Format transcript with speaker labels."""
-    formatted_lines = []
+    lines = []
+    words = []
     current_speaker = None
-    
-    import boto3
-    from urllib.parse import urlparse
-
-    # Assuming 'transcript' contains the TranscriptFileUri
-    s3_uri = transcript['TranscriptFileUri']
-
-    print('parsing URI')
-    # Parse the S3 URI
-    parsed_uri = urlparse(s3_uri)
-    bucket_name = parsed_uri.netloc
-    object_key = parsed_uri.path.lstrip('/')
-
-    print(parsed_uri, bucket_name, object_key)
-
-    # Create an S3 client
-    s3_client = boto3.client('s3')
-
-    print('donwloading file')
-    # Download the file
-    local_file_name = 'downloaded_transcript.json'
-    s3_client.download_file(bucket_name, object_key, local_file_name)
-
-    # Now read the local file and parse it
-    import json
-    with open(local_file_name, 'r') as file:
-        transcript_data = json.load(file)
-
-    # Now you can iterate over the items
-    for item in transcript_data['results']['items']:
-        # Process each item
-        print(f"item: {item}")
-
-    print(f"Transcript: {transcript}")
-    for item in transcript['items']:
-        if 'speaker_label' in item and item['speaker_label'] != current_speaker:
-            current_speaker = item['speaker_label']
-            formatted_lines.append(f"\n[{current_speaker}]")
-        
-        if 'alternatives' in item and item['alternatives']:
-            formatted_lines.append(item['alternatives'][0]['content'])
-    
-    return ' '.join(formatted_lines)
+    for item in results['items']:
+        if not item.get('alternatives'):
+            continue
+        content = item['alternatives'][0]['content']
+
+        if item['type'] == 'punctuation':
+            if words:
+                words[-1] += content
+            continue
+
+        speaker = item.get('speaker_label') or speakers.get(item.get('start_time'))
+        if speaker != current_speaker and words:
+            lines.append(_speaker_line(current_speaker, words))
+            words = []
+        current_speaker = speaker
+        words.append(content)
+
+    if words:
+        lines.append(_speaker_line(current_speaker, words))
+    return '\n'.join(lines)
+
+def _speaker_line(speaker: str, words: list) -> str:
+    text = ' '.join(words)
+    return f"[{speaker}] {text}" if speaker else text
@@ -0,0 +1,157 @@
+import bisect
+from typing import Dict, Iterable, Iterator, List, Optional
+import numpy as np
+from config import Config
+
+class SilenceTrimmer:
+    """Drops long non-speech spans from a stream of int16 blocks.
+
+    Frames of Config.VAD_FRAME_MS are speech when their energy is above
+    Config.VAD_THRESHOLD_DB (dBFS). A silent run longer than
+    Config.VAD_MIN_SILENCE keeps Config.VAD_PADDING on either side and
+    loses the middle. At most one such run is buffered, so memory is
+    bounded by the minimum silence length, not the file length.
+
+    `kept_intervals` maps the trimmed audio back to the original as
+    [original_start, trimmed_start, length] triples, in seconds.
+    """
+
+    def __init__(self, rate: int):
+        self.rate = rate
+        self.frame = max(1, int(rate * Config.VAD_FRAME_MS / 1000))
+        self.threshold = 10 ** (Config.VAD_THRESHOLD_DB / 10)
+        self.pad = int(Config.VAD_PADDING * rate) // self.frame * self.frame
+        self.min_silence = int(Config.VAD_MIN_SILENCE * rate)
+
+        self.offset = 0    # original sample index of self.carry[0]
+        self.written = 0   # samples emitted so far
+        self.carry = None  # partial frame left over from the last block
+        self.silent = 0    # samples in the current silent run
+        self.dropping = False
+        self.held = None   # silence after the left padding, not yet kept or dropped
+        self.held_start = 0
+        self.intervals: List[List[int]] = []
+
+    @property
+    def kept_intervals(self) -> List[List[float]]:
+        return [[start / self.rate, trimmed / self.rate, length / self.rate]
+                for start, trimmed, length in self.intervals]
+
+    def trim(self, blocks: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+        """Yield the kept audio of each block."""
+        for block in blocks:
+            kept = self.push(block)
+            if kept is not None:
+                yield kept
+        kept = self.flush()
+        if kept is not None:
+            yield kept
+
+    def push(self, block: np.ndarray) -> Optional[np.ndarray]:
+        """Return the audio that can be kept so far, for callers that route blocks themselves."""
+        out = self._process(block)
+        return np.concatenate(out) if out else None
+
+    def flush(self) -> Optional[np.ndarray]:
+        """Return what is left to keep once the stream has ended."""
+        out = self._finish()
+        return np.concatenate(out) if out else None
+
+    def _emit(self, samples: np.ndarray, start: int, out: list) -> None:
+        if not len(samples):
+            return
+        last = self.intervals[-1] if self.intervals else None
+        if last is not None and last[0] + last[2] == start:
+            last[2] += len(samples)
+        else:
+            self.intervals.append([int(start), self.written, len(samples)])
+        self.written += len(samples)
+        out.append(samples)
+
+    def _process(self, block: np.ndarray) -> list:
+        samples = block if self.carry is None else np.concatenate([self.carry, block])
+        n = len(samples) // self.frame
+        whole = n * self.frame
+        self.carry = samples[whole:]
+        if n == 0:
+            return []
+
+        frames = samples[:whole].reshape(n, self.frame, -1).astype(np.float32) / 32768.0
+        speech = np.square(frames).mean(axis=(1, 2)) > self.threshold
+
+        out = []
+        # Walk runs of equal speech/silence frames rather than single frames
+        edges = np.flatnonzero(np.diff(speech)) + 1
+        for start, end in zip(np.r_[0, edges], np.r_[edges, n]):
+            run = samples[start * self.frame:end * self.frame]
+            run_start = self.offset + start * self.frame
+            if speech[start]:
+                self._end_silence(out)
+                self._emit(run, run_start, out)
+            else:
+                self._extend_silence(run, run_start, out)
+        self.offset += whole
+        return out
+
+    def _extend_silence(self, run: np.ndarray, run_start: int, out: list) -> None:
+        # The first VAD_PADDING of any silence is always kept
+        left = min(len(run), max(0, self.pad - self.silent))
+        self._emit(run[:left], run_start, out)
+        self.silent += len(run)
+        rest = run[left:]
+        if not len(rest):
+            return
+
+        if self.held is None:
+            self.held, self.held_start = rest, run_start + left
+        else:
+            self.held = np.concatenate([self.held, rest])
+        if self.silent > self.min_silence:
+            self.dropping = True
+        if self.dropping and len(self.held) > self.pad:
+            # Only the last VAD_PADDING before the next speech can still be kept
+            self.held_start += len(self.held) - self.pad
+            self.held = self.held[len(self.held) - self.pad:]
+
+    def _end_silence(self, out: list) -> None:
+        if self.held is not None:
+            self._emit(self.held, self.held_start, out)
+        self.held = None
+        self.silent = 0
+        self.dropping = False
+
+    def _finish(self) -> list:
+        out = []
+        if not self.dropping:
+            self._end_silence(out)
+            if self.carry is not None:
+                self._emit(self.carry, self.offset, out)
+        return out
+
+def to_original_time(t: float, kept_intervals: List[List[float]]) -> float:
+    """Map a time in trimmed audio back to the original recording."""
+    i = bisect.bisect_right([trimmed for _, trimmed, _ in kept_intervals], t) - 1
+    if i < 0:
+        return t
+    start, trimmed, _ = kept_intervals[i]
+    return start + (t - trimmed)
+
+def remap_transcript_times(transcript_data: Dict,
+                           kept_intervals: Optional[List[List[float]]]) -> Dict:
+    """Rewrite item and speaker-segment times from trimmed to original positions."""
+    if not kept_intervals:
+        return transcript_data
+
+    def remap(entry: Dict) -> None:
+        for key in ('start_time', 'end_time'):
+            if key in entry:
+                entry[key] = f"{to_original_time(float(entry[key]), kept_intervals):.3f}"
+
+    results = transcript_data['results']
+    for item in results.get('items', []):
+        remap(item)
+    for segment in results.get('speaker_labels', {}).get('segments', []):
+        remap(segment)
+        for segment_item in segment.get('items', []):
+            remap(segment_item)
+    return transcript_data
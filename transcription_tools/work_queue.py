@@ -0,0 +1,237 @@
+import argparse
+import contextlib
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from config import Config
+
+@dataclass
+class WorkLease:
+    """A claimed item: one input file, held by one worker until the lease expires."""
+    item_id: int
+    path: str  # relative to the input directory, which each node mounts its own way
+    duration: float
+    token: str  # changes on every claim, so a stale holder cannot complete the item
+    attempts: int
+
+class WorkQueue(ABC):
+    """Input files shared out to worker processes on any number of machines.
+
+    A coordinator puts every file in; workers claim one at a time with a
+    lease they must heartbeat. A lease that is not renewed in time (the
+    worker crashed or lost the storage) is returned to the queue, and an
+    item claimed Config.QUEUE_MAX_ATTEMPTS times without finishing is
+    marked failed. Items are claimed longest first.
+    """
+
+    @abstractmethod
+    def put(self, items: Iterable[Tuple[str, float]]) -> int:
+        """Add (path, audio seconds) items not queued before; return how many were new."""
+
+    @abstractmethod
+    def claim(self, worker: str, lease_seconds: float) -> Optional[WorkLease]:
+        """Lease the longest waiting item to worker, or return None if none is waiting."""
+
+    @abstractmethod
+    def heartbeat(self, leases: List[WorkLease], lease_seconds: float) -> List[WorkLease]:
+        """Extend the given leases; return those that were lost to expiry."""
+
+    @abstractmethod
+    def complete(self, lease: WorkLease) -> bool:
+        """Mark the item done; False if the lease had already been lost."""
+
+    @abstractmethod
+    def fail(self, lease: WorkLease, error: str) -> bool:
+        """Give the item back for another attempt, or mark it failed after the last one."""
+
+    @abstractmethod
+    def reclaim_expired(self) -> int:
+        """Return items whose lease has expired to the queue; return how many."""
+
+    @abstractmethod
+    def counts(self) -> Dict[str, int]:
+        """Number of items per status: pending, leased, done, failed."""
+
+    @abstractmethod
+    def set_sealed(self, sealed: bool) -> None:
+        """Sealed means the coordinator has put everything; workers stop once it drains."""
+
+    @abstractmethod
+    def is_sealed(self) -> bool:
+        """True once the coordinator has finished putting items."""
+
+    def close(self) -> None:
+        pass
+
+class SQLiteWorkQueue(WorkQueue):
+    """Queue in a SQLite database on storage every node mounts.
+
+    Uses a rollback journal rather than WAL, since WAL needs shared memory
+    that network filesystems do not provide; the filesystem must support
+    POSIX locks. Lease times are wall-clock, so nodes' clocks should agree
+    to well within Config.QUEUE_LEASE_SECONDS.
+    """
+
+    def __init__(self, path: str):
+        self.lock = threading.Lock()
+        # Transactions are explicit, so claims can take the write lock up front
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                duration REAL NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                owner TEXT,
+                token TEXT,
+                lease_expires REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT
+            )
+        """)
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS items_waiting ON items (status, duration DESC)"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                if self.conn.in_transaction:
+                    self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def put(self, items: Iterable[Tuple[str, float]]) -> int:
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO items (path, duration) VALUES (?, ?)", items
+            )
+            return conn.total_changes - before
+
+    def claim(self, worker: str, lease_seconds: float) -> Optional[WorkLease]:
+        with self._transaction() as conn:
+            now = time.time()
+            self._reclaim(conn, now)
+            row = conn.execute(
+                "SELECT id, path, duration, attempts FROM items WHERE status = 'pending' "
+                "ORDER BY duration DESC LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            item_id, path, duration, attempts = row
+            token = uuid.uuid4().hex
+            conn.execute(
+                "UPDATE items SET status = 'leased', owner = ?, token = ?, lease_expires = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (worker, token, now + lease_seconds, item_id)
+            )
+        return WorkLease(item_id, path, duration, token, attempts + 1)
+
+    def heartbeat(self, leases: List[WorkLease], lease_seconds: float) -> List[WorkLease]:
+        lost = []
+        with self._transaction() as conn:
+            expires = time.time() + lease_seconds
+            for lease in leases:
+                updated = conn.execute(
+                    "UPDATE items SET lease_expires = ? "
+                    "WHERE id = ? AND token = ? AND status = 'leased'",
+                    (expires, lease.item_id, lease.token)
+                ).rowcount
+                if not updated:
+                    lost.append(lease)
+        return lost
+
+    def complete(self, lease: WorkLease) -> bool:
+        return self._release(lease, 'done', None)
+
+    def fail(self, lease: WorkLease, error: str) -> bool:
+        status = 'failed' if lease.attempts >= Config.QUEUE_MAX_ATTEMPTS else 'pending'
+        return self._release(lease, status, error)
+
+    def _release(self, lease: WorkLease, status: str, error: Optional[str]) -> bool:
+        with self._transaction() as conn:
+            return conn.execute(
+                "UPDATE items SET status = ?, error = ?, owner = NULL, token = NULL, "
+                "lease_expires = NULL WHERE id = ? AND token = ? AND status = 'leased'",
+                (status, error, lease.item_id, lease.token)
+            ).rowcount == 1
+
+    def reclaim_expired(self) -> int:
+        with self._transaction() as conn:
+            return self._reclaim(conn, time.time())
+
+    def _reclaim(self, conn: sqlite3.Connection, now: float) -> int:
+        failed = conn.execute(
+            "UPDATE items SET status = 'failed', error = 'lease expired', owner = NULL, "
+            "token = NULL, lease_expires = NULL "
+            "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+            (now, Config.QUEUE_MAX_ATTEMPTS)
+        ).rowcount
+        returned = conn.execute(
+            "UPDATE items SET status = 'pending', owner = NULL, token = NULL, "
+            "lease_expires = NULL WHERE status = 'leased' AND lease_expires < ?",
+            (now,)
+        ).rowcount
+        return failed + returned
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) FROM items GROUP BY status"
+            ).fetchall()
+        return dict(rows)
+
+    def set_sealed(self, sealed: bool) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('sealed', ?)",
+                ('1' if sealed else '0',)
+            )
+
+    def is_sealed(self) -> bool:
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'sealed'").fetchone()
+        return row is not None and row[0] == '1'
+
+    def close(self) -> None:
+        self.conn.close()
+
+def open_queue(path: Optional[str] = None) -> WorkQueue:
+    """Open the work queue backend selected by Config.QUEUE_BACKEND.
+
+    SQS would be another WorkQueue: its visibility timeout is the lease and
+    ChangeMessageVisibility the heartbeat.
+    """
+    if Config.QUEUE_BACKEND == 'sqlite':
+        return SQLiteWorkQueue(path or Config.QUEUE_PATH)
+    raise ValueError(f"Unknown work queue backend: {Config.QUEUE_BACKEND}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show or repair a shared transcription work queue')
+    parser.add_argument('--queue', help='Queue location (default: Config.QUEUE_PATH)')
+    parser.add_argument('--reclaim', action='store_true',
+                        help='Return expired leases to the queue now')
+    args = parser.parse_args()
+
+    queue = open_queue(args.queue)
+    try:
+        if args.reclaim:
+            print(f"Returned {queue.reclaim_expired()} expired leases.")
+        counts = queue.counts()
+        print(', '.join(f"{status} {counts.get(status, 0)}"
+                        for status in ('pending', 'leased', 'done', 'failed'))
+              + (" (sealed)" if queue.is_sealed() else ""))
+    finally:
+        queue.close()